@@ -1,5 +1,6 @@
 """
-Provides the AudioListener class, which listens to audio input and provides audio and FFT data using threading and queues.
+Provides the AudioListener class, which listens to audio input and provides audio and FFT data using threading and
+preallocated ring buffers.
 
 Author: Landry Bulls
 Date: 8/23/24
@@ -7,18 +8,26 @@ Date: 8/23/24
 
 import threading
 import queue
-import sounddevice as sd
 import numpy as np
-from scipy.fftpack import rfft
 import time
 from config import audio_parameters
-import curses
+from ring_buffer import FrameRingBuffer
+from stft import STFT
+from features import MelFeatures
+from latency import LatencyTracker
+from onset import OnsetDetector
+from tempo import TempoTracker
 
 SAMPLERATE = audio_parameters['SAMPLERATE']
 BLOCKSIZE = audio_parameters['BLOCKSIZE']
+WINDOW_LENGTH = audio_parameters['WINDOW_LENGTH']
+HOP_SIZE = audio_parameters['HOP_SIZE']
+WINDOW = audio_parameters['WINDOW']
+BUFFER_BLOCKS = 16  # how many blocks each ring buffer holds before the oldest is overwritten
 
 # get blackhole audio device
 def get_blackhole_device_idx():
+    import sounddevice as sd
     devices = sd.query_devices()
     for device in devices:
         if 'BlackHole' in device['name']:
@@ -26,35 +35,94 @@ def get_blackhole_device_idx():
     return None
 
 class AudioListener(threading.Thread):
-    def __init__(self, sample_rate=SAMPLERATE, block_size=BLOCKSIZE, channels=1):
+    def __init__(self, sample_rate=SAMPLERATE, block_size=BLOCKSIZE, channels=1, buffer_blocks=BUFFER_BLOCKS, device_idx=None,
+                 window_length=WINDOW_LENGTH, hop_size=HOP_SIZE, window=WINDOW):
         threading.Thread.__init__(self)
         self.sample_rate = sample_rate
         self.block_size = block_size
         self.channels = channels
-        self.audio_queue = queue.Queue()
-        self.fft_queue = queue.Queue()
+        self.stft = STFT(window_length, hop_size, window, sample_rate)
+        # the callback only copies samples into audio_buffer; run() turns them into STFT frames in fft_buffer
+        frames_per_block = -(-block_size // hop_size)
+        self.audio_buffer = FrameRingBuffer(buffer_blocks, block_size)
+        self.fft_buffer = FrameRingBuffer(buffer_blocks * frames_per_block, self.stft.n_bins)
+        # mel energies and MFCCs are written in lockstep with fft_buffer, so a frame has the same seq in all three
+        self.features = MelFeatures(sample_rate, window_length)
+        self.mel_buffer = FrameRingBuffer(self.fft_buffer.capacity, len(self.features.mel))
+        self.mfcc_buffer = FrameRingBuffer(self.fft_buffer.capacity, len(self.features.mfcc))
+        # the flux over the whole mel range is the onset envelope the tempo is estimated from; summing the flux of
+        # every mel band is the same as one band weighted by the whole filterbank
+        frame_seconds = hop_size / sample_rate
+        envelope_band = self.features.filterbank.mean(axis=0)
+        self.onsets = OnsetDetector([envelope_band], n_bins=self.stft.n_bins, frame_seconds=frame_seconds)
+        self.tempo = TempoTracker(frame_seconds)
+        self.block_ready = threading.Event()
+        self.fft_ready = threading.Condition()  # notified once per batch of new FFT frames
         self.running = threading.Event()
         self.error_queue = queue.Queue()
-        self.device_idx = get_blackhole_device_idx()
+        self.device_idx = device_idx  # looked up when the stream starts, so offline use needs no sound card
+        self.latency = LatencyTracker()  # shared with the LightController, which records the later stages
+        self._block = np.zeros(block_size, dtype=np.float32)
 
-    def audio_callback(self, indata, frames, time, status):
+    def audio_callback(self, indata, frames, time_info, status):
         if status:
             self.error_queue.put(f"Audio callback error: {status}")
         try:
-            audio_data = np.copy(indata[:, 0])
-            fft_data = np.abs(np.fft.rfft(np.sum(indata, axis=1), n=None))
-            self.audio_queue.put(audio_data)
-            self.fft_queue.put(fft_data)
+            # stamp the block with when it hit the ADC, moved from PortAudio's stream clock onto time.monotonic()
+            adc_time = time.monotonic()
+            if time_info is not None:
+                adc_time -= time_info.currentTime - time_info.inputBufferAdcTime
+            if self.channels == 1:
+                self.audio_buffer.write(indata[:, 0], adc_time)
+            else:
+                self.audio_buffer.write(indata.sum(axis=1), adc_time)
+            self.block_ready.set()
         except Exception as e:
             self.error_queue.put(f"Error processing audio data: {str(e)}")
 
+    def _publish(self, magnitude, timestamp):
+        mel, mfcc = self.features.process(magnitude)
+        self.mel_buffer.write(mel, timestamp)
+        self.mfcc_buffer.write(mfcc, timestamp)
+        self.onsets.process(magnitude)
+        self.tempo.process(float(self.onsets.flux[0]), timestamp)
+        self.fft_buffer.write(magnitude, timestamp)
+        if self.latency is not None:
+            self.latency.record('fft', timestamp)
+
+    def process_pending(self):
+        """
+        Runs every audio block the callback has written since the last call through the STFT and publishes the
+        resulting frames to fft_buffer.
+
+        Returns:
+        int: The number of FFT frames published.
+        """
+        published = 0
+        while True:
+            frame = self.audio_buffer.read_next(out=self._block)
+            if frame is None:
+                break
+            _, block, timestamp = frame
+            published += self.stft.push(block, timestamp, self._publish)
+        if published:
+            with self.fft_ready:
+                self.fft_ready.notify_all()
+        return published
+
     def run(self):
         self.running.set()
         try:
+            # imported here so the analysis side of the listener can be used without PortAudio installed
+            import sounddevice as sd
+            if self.device_idx is None:
+                self.device_idx = get_blackhole_device_idx()
             with sd.InputStream(callback=self.audio_callback, channels=self.channels, 
                                 samplerate=self.sample_rate, blocksize=self.block_size, device=self.device_idx):
                 while self.running.is_set():
-                    sd.sleep(100)
+                    if self.block_ready.wait(timeout=0.1):
+                        self.block_ready.clear()
+                        self.process_pending()
         except Exception as e:
             self.error_queue.put(f"Error in audio stream: {str(e)}")
 
@@ -62,16 +130,56 @@ class AudioListener(threading.Thread):
         self.running.clear()
 
     def get_audio_data(self):
-        try:
-            return self.audio_queue.get_nowait()
-        except queue.Empty:
+        latest = self.audio_buffer.read_latest()
+        if latest is None:
             return None
+        return latest[1]
+
+    def wait_for_fft(self, timeout=0.1):
+        """
+        Blocks until there is an FFT frame the reader has not seen yet, or until the timeout runs out.
+
+        Returns:
+        bool: Whether an unseen frame is available.
+        """
+        with self.fft_ready:
+            return self.fft_ready.wait_for(self.fft_buffer.has_unseen, timeout=timeout)
 
     def get_fft_data(self, timeout=0.08):
-        try:
-            return self.fft_queue.get(timeout=timeout)
-        except queue.Empty:
+        if not self.wait_for_fft(timeout):
+            return None
+        frame = self.fft_buffer.read_next()
+        if frame is None:
+            return None
+        return frame[1]
+
+    def frame_age(self, timestamp):
+        """
+        Returns how many seconds ago a frame with the given capture timestamp was recorded.
+        """
+        return time.monotonic() - timestamp
+
+    def worst_case_age(self):
+        """
+        Returns the oldest a frame can be when read with read_next before it gets overwritten, in seconds.
+        """
+        return self.fft_buffer.capacity * self.stft.hop_size / self.sample_rate
+
+    def get_mfcc_data(self):
+        latest = self.mfcc_buffer.read_latest()
+        if latest is None:
             return None
+        return latest[1]
+
+    def get_tempo(self):
+        """
+        Returns:
+        tuple: (bpm, confidence), with bpm None until there is enough audio for an estimate.
+        """
+        return self.tempo.bpm, self.tempo.confidence
+
+    def get_stats(self):
+        return {'audio': self.audio_buffer.stats(), 'fft': self.fft_buffer.stats()}
 
     def get_errors(self):
         errors = []
@@ -80,6 +188,9 @@ class AudioListener(threading.Thread):
         return errors
 
 def main():
+    # only the demo needs these; the light loop doesn't pay for importing them
+    import curses
+    import sounddevice as sd
     stdscr = curses.initscr()
 
     audio_listener = AudioListener()
@@ -0,0 +1,511 @@
+"""
+benchmark.py
+
+Description: Benchmarks the per-frame hot path: the mapping kernels, AudioListener.audio_callback and its STFT stage,
+LightController.send_dynamic for every scene in scenes/ on every profile in profiles/, and sending universes through
+the Art-Net and sACN outputs to a DMXReceiver on localhost, whose packets/sec are reported after the run. Each
+benchmark is fed synthetic audio blocks of BLOCKSIZE or FFT frames of WINDOW_LENGTH and reports mean, p50 and p99
+latency per frame and the bytes allocated per frame. Results can be stored as a baseline and later runs are compared
+against it. Only the p50, the best of several repeats, is gated on: the p99 of a few thousand frames mostly measures
+what else the machine was doing, so it is shown against the baseline for information. A fixed calibration frame is
+timed alongside every benchmark and the baseline is scaled up by how much slower it ran, so a machine that is busier or
+clocked lower than when the baseline was recorded doesn't read as a regression.
+
+Usage:
+    python benchmark.py                  # run and compare against benchmark_baseline.json
+    python benchmark.py --save-baseline  # run and store the results as the new baseline
+    python benchmark.py -k hell          # only run benchmarks whose name contains 'hell'
+    python benchmark.py --imports        # check the cold import time of run_lights.py against its budget
+    python benchmark.py --playback       # check PlaybackService's track change detection against a stub API
+    python benchmark.py --hot-swap       # check that editing a light out of the live scene turns its channels off
+    python benchmark.py --cache          # check that plans from the scene cache render what fresh ones do
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from config import audio_parameters
+from mapping import fft_to_rgb, fft_to_dimmer, fft_to_strobe, time_rgb, time_dimmer, time_strobe, bool_rgb
+from audio_listener import AudioListener
+from scene_manager import SceneManager
+from control import LightController, load_profile, universe_configs, CHANNELS_PER_TYPE
+from outputs import UNIVERSE_SIZE, open_output, NullOutput
+from dmx_receiver import DMXReceiver
+
+SAMPLERATE = audio_parameters['SAMPLERATE']
+BLOCKSIZE = audio_parameters['BLOCKSIZE']
+WINDOW_LENGTH = audio_parameters['WINDOW_LENGTH']
+BASELINE_FILE = 'benchmark_baseline.json'
+REGRESSION_FACTOR = 1.5  # a p50 this many times the baseline counts as a regression
+REPEATS = 3  # timing passes per benchmark, the best p50 counts
+CALIBRATION_FRAMES = 500  # calibration frames timed before each pass
+
+def synthetic_audio(n_frames, seed=0, block_size=BLOCKSIZE):
+    rng = np.random.default_rng(seed)
+    return (rng.standard_normal((n_frames, block_size)) * 0.2).astype(np.float32)
+
+def synthetic_fft(n_frames, seed=0):
+    return np.abs(np.fft.rfft(synthetic_audio(n_frames, seed, WINDOW_LENGTH), axis=1)).astype(np.float32)
+
+_calibration_universe = np.zeros(512, dtype=np.uint8)
+_calibration_offsets = np.arange(0, 512, 6)
+_calibration_fft = np.linspace(0, 1, WINDOW_LENGTH // 2 + 1, dtype=np.float32)
+
+def calibration_frame(i):
+    """
+    A fixed stand-in for a frame: a few small NumPy operations and a short Python loop, timed next to every benchmark
+    so results can be compared across runs on a machine whose speed varies.
+    """
+    energies = np.add.reduceat(_calibration_fft, _calibration_offsets)
+    _calibration_universe[_calibration_offsets] = np.clip(energies * 16, 0, 255)
+    total = 0
+    for value in range(32):
+        total += value * i
+    return total
+
+def time_frames(frame_fn, n_frames):
+    latencies = np.zeros(n_frames, dtype=np.float64)
+    clock = time.perf_counter_ns
+    for i in range(n_frames):
+        start = clock()
+        frame_fn(i)
+        latencies[i] = clock() - start
+    return latencies / 1000
+
+def measure(frame_fn, n_frames, warmup=50, repeats=REPEATS):
+    """
+    Times frame_fn(i) for i in range(n_frames), repeats times over, and measures how much it allocates per call.
+    Before each pass calibration_frame is timed too.
+
+    Returns:
+    dict: mean and p99 latency over all repeats and the best p50 of any repeat in microseconds, the best p50 of the
+        calibration frame, and the mean bytes allocated per frame.
+    """
+    for i in range(min(warmup, n_frames)):
+        frame_fn(i)
+
+    latencies = np.zeros((repeats, n_frames), dtype=np.float64)
+    calibration = np.zeros(repeats, dtype=np.float64)
+    for repeat in range(repeats):
+        calibration[repeat] = np.percentile(time_frames(calibration_frame, CALIBRATION_FRAMES), 50)
+        latencies[repeat] = time_frames(frame_fn, n_frames)
+
+    # allocation pass, kept separate because tracing slows every allocation down
+    n_traced = min(n_frames, 200)
+    allocated = 0
+    tracemalloc.start()
+    for i in range(n_traced):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        frame_fn(i)
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+
+    return {
+        'mean_us': float(latencies.mean()),
+        'p50_us': float(np.percentile(latencies, 50, axis=1).min()),
+        'calibration_us': float(calibration.min()),
+        'p99_us': float(np.percentile(latencies, 99)),
+        'alloc_bytes': allocated / n_traced,
+    }
+
+def mapping_benchmarks(fft_frames):
+    rgb_light = {'min_brightness': 0, 'max_brightness': 255, 'frequency': 1, 'function': 'sine', 'color': 'red', 'strobe': 0}
+    dimmer_light = {'min_brightness': 0, 'max_brightness': 255, 'frequency': 1, 'function': 'sine'}
+    strobe_light = {'speed_range': [0, 255], 'brightness_range': [0, 255], 'frequency': 1, 'function': 'sine', 'target': 'both'}
+    bool_light = {'brightness': 'random', 'color': 'random', 'strobe': 'random'}
+    n = len(fft_frames)
+    return {
+        'mapping.fft_to_rgb': lambda i: fft_to_rgb(fft_frames[i % n], [20, 500], [1, 5], [0, 255], 'random', 0),
+        'mapping.fft_to_dimmer': lambda i: fft_to_dimmer(fft_frames[i % n], [20, 500], [1, 5], [0, 255]),
+        'mapping.fft_to_strobe': lambda i: fft_to_strobe(fft_frames[i % n], [2000, 5000], 1),
+        'mapping.time_rgb': lambda i: time_rgb(rgb_light),
+        'mapping.time_dimmer': lambda i: time_dimmer(dimmer_light),
+        'mapping.time_strobe': lambda i: time_strobe(strobe_light),
+        'mapping.bool_rgb': lambda i: bool_rgb(bool_light),
+    }
+
+def audio_benchmarks(audio_frames):
+    audio_listener = AudioListener()
+    indata = audio_frames[:, :, None]
+    n = len(audio_frames)
+
+    def callback(i):
+        audio_listener.audio_callback(indata[i % n], BLOCKSIZE, None, None)
+
+    def callback_and_fft(i):
+        audio_listener.audio_callback(indata[i % n], BLOCKSIZE, None, None)
+        audio_listener.process_pending()
+
+    return {
+        'audio_listener.audio_callback': callback,
+        'audio_listener.audio_callback+stft': callback_and_fft,
+    }
+
+def send_dynamic_benchmarks(fft_frames, scenes_directory='scenes', profiles_directory='profiles'):
+    """
+    Returns the send_dynamic benchmarks of every scene on every profile, and the LightController of each by benchmark
+    name, to be stopped once it has been measured.
+    """
+    benchmarks, controllers = {}, {}
+    n = len(fft_frames)
+    scene_names = list(SceneManager(scenes_directory).scenes.keys())
+    profile_names = sorted(name[:-5] for name in os.listdir(profiles_directory) if name.endswith('.json'))
+    for profile_name in profile_names:
+        for scene_name in scene_names:
+            audio_listener = AudioListener()
+            scene_manager = SceneManager(scenes_directory)
+            try:
+                n_universes = len(universe_configs(load_profile(profile_name)))
+                light_controller = LightController(audio_listener, profile_name, scene_manager,
+                                                   outputs=[NullOutput() for _ in range(n_universes)])
+            except ValueError as e:
+                print(f"Skipping profile '{profile_name}': {str(e)}")
+                break
+            scene_manager.set_scene(scene_name)
+
+            def frame(i, audio_listener=audio_listener, light_controller=light_controller):
+                audio_listener.fft_buffer.write(fft_frames[i % n])
+                light_controller.send_dynamic()
+
+            name = f'send_dynamic[{scene_name}/{profile_name}]'
+            benchmarks[name] = frame
+            controllers[name] = light_controller
+    return benchmarks, controllers
+
+IMPORT_CHECK = """
+import sys, time
+start = time.perf_counter()
+import run_lights
+elapsed = time.perf_counter() - start
+print(elapsed)
+print(' '.join(name for name in run_lights.HEAVY_MODULES if name in sys.modules))
+"""
+
+def import_check(runs=5):
+    """
+    Imports run_lights in fresh interpreters and checks the best time against run_lights.IMPORT_BUDGET_SECONDS and
+    that none of run_lights.HEAVY_MODULES were imported along the way.
+
+    Returns:
+    bool: Whether the check passed.
+    """
+    from run_lights import IMPORT_BUDGET_SECONDS
+    directory = os.path.dirname(os.path.abspath(__file__))
+    times, heavy = [], set()
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', IMPORT_CHECK], cwd=directory, capture_output=True, text=True,
+                                check=True).stdout.splitlines()
+        times.append(float(output[0]))
+        heavy.update(output[1].split() if len(output) > 1 else [])
+    best = min(times)
+    passed = best <= IMPORT_BUDGET_SECONDS and not heavy
+    print(f"import run_lights: {best * 1000:.0f} ms best of {runs} (budget {IMPORT_BUDGET_SECONDS * 1000:.0f} ms)")
+    if heavy:
+        print(f"import run_lights pulled in: {', '.join(sorted(heavy))}")
+    return passed
+
+def transition_benchmarks(fft_frames, pairs=(('hell', 'static'), ('wavies', 'pulse')), profile_name='testing'):
+    """
+    Returns benchmarks of send_dynamic in the middle of a crossfade, with both scenes rendering every frame, and their
+    LightControllers by benchmark name.
+    """
+    benchmarks, controllers = {}, {}
+    n = len(fft_frames)
+    for outgoing, incoming in pairs:
+        audio_listener = AudioListener()
+        scene_manager = SceneManager()
+        light_controller = LightController(audio_listener, profile_name, scene_manager, outputs=[NullOutput()])
+        scene_manager.set_scene(outgoing)
+        # the outgoing side of a transition is the plan the last frame rendered
+        audio_listener.fft_buffer.write(fft_frames[0])
+        light_controller.send_dynamic()
+        light_controller.change_scene(incoming, 'crossfade', duration_ms=1e12)  # never finishes
+
+        def frame(i, audio_listener=audio_listener, light_controller=light_controller):
+            audio_listener.fft_buffer.write(fft_frames[i % n])
+            light_controller.send_dynamic()
+
+        name = f'send_dynamic[{outgoing}->{incoming}/{profile_name}]'
+        benchmarks[name] = frame
+        controllers[name] = light_controller
+    return benchmarks, controllers
+
+def output_benchmarks(universes=4):
+    """
+    Returns the benchmarks of the network outputs, and (receiver, outputs) pairs of each receiver and the outputs
+    that send to it.
+    """
+    benchmarks, receivers = {}, []
+    frames = np.random.default_rng(0).integers(0, 256, (256, 512), dtype=np.uint8)
+    for protocol in ('artnet', 'sacn'):
+        receiver = DMXReceiver(protocol, port=0)
+        receiver.start()
+        outputs = [open_output({'output': protocol, 'host': '127.0.0.1', 'port': receiver.port, 'universe': u + 1})
+                   for u in range(universes)]
+        receivers.append((receiver, outputs))
+
+        def frame(i, outputs=outputs):
+            for output in outputs:
+                output.send(frames[i % len(frames)])
+
+        benchmarks[f'outputs.{protocol}.send[{universes} universes]'] = frame
+    return benchmarks, receivers
+
+def playback_check(durations_ms=(3000, 2000, 4000), max_late=0.5):
+    """
+    Plays stub tracks to a PlaybackService and checks that it sees every track change within max_late seconds, with
+    fewer requests than polling at a fixed rate would take for the same latency.
+
+    Returns:
+    bool: Whether the check passed.
+    """
+    from playback import PlaybackService
+    from playback_stub import StubPlayer, stub_tracks
+    player = StubPlayer(stub_tracks(durations_ms))
+    player.start()
+    service = PlaybackService('stub-token', api_base=player.api_base)
+    service.start()
+    seen = []
+    deadline = time.monotonic() + sum(durations_ms) / 1000 + 2
+    while len(seen) < len(durations_ms) and time.monotonic() < deadline:
+        event = service.get_event(timeout=0.1)
+        if event is not None and event['track_id'] is not None:
+            seen.append(event)
+    service.stop()
+    player.stop()
+
+    late = [event['time'] - change for event, change in zip(seen[1:], player.change_times())]
+    naive = sum(durations_ms) / 1000 / service.boundary_interval
+    passed = len(seen) == len(durations_ms) and all(0 <= t <= max_late for t in late) and service.requests < naive
+    print(f"playback: {len(seen)} of {len(durations_ms)} tracks seen, changes "
+          f"{', '.join(f'{t * 1000:.0f}' for t in late)} ms late, {service.requests} requests "
+          f"(fixed-rate polling for the same latency: {naive:.0f})")
+    for error in service.get_errors():
+        print(f"playback error: {error}")
+    return passed
+
+def stop_controller(light_controller):
+    light_controller.stop()
+    for writer in light_controller.writers:
+        writer.join()
+
+def hot_swap_check(scene_name='testing', profile_name='testing', n_frames=5):
+    """
+    Plays a scene, removes its first lit light from the scene file while it is live, and checks that the reloaded
+    scene leaves that light's channels at 0.
+
+    Returns:
+    bool: Whether the check passed.
+    """
+    directory = tempfile.mkdtemp()
+    shutil.copy(os.path.join('scenes', scene_name + '.json'), directory)
+    audio_listener = AudioListener()
+    scene_manager = SceneManager(directory, cache_directory=None)
+    light_controller = LightController(audio_listener, profile_name, scene_manager, outputs=[NullOutput()],
+                                       frame_rate=0)
+    scene_manager.set_scene(scene_name)
+    loud = np.full(audio_listener.stft.n_bins, 1000.0, dtype=np.float32)
+    sent = light_controller.sent_universes.reshape(-1)
+    channels = {}
+    for light in light_controller.profile['lights']:
+        if light['name'] in light_controller.channel_layout:
+            offset = light_controller.channel_layout[light['name']]
+            channels[light['name']] = slice(offset, offset + light.get('n_channels', CHANNELS_PER_TYPE[light['type']]))
+
+    def play():
+        for _ in range(n_frames):
+            audio_listener.fft_buffer.write(loud)
+            light_controller.send_dynamic()
+
+    try:
+        play()
+        scene = scene_manager.scenes[scene_name]
+        lit = [light['name'] for light in scene['lights']
+               if light['name'] in channels and sent[channels[light['name']]].any()]
+        if not lit:
+            print(f"hot swap: no light of '{scene_name}' lit up, nothing to check")
+            return False
+        removed = lit[0]
+        edited = dict(scene, lights=[light for light in scene['lights'] if light['name'] != removed])
+        with open(os.path.join(directory, scene_name + '.json'), 'w') as f:
+            json.dump(edited, f)
+        scene_manager.reload_scenes()
+        play()
+    finally:
+        light_controller.stop()
+        shutil.rmtree(directory)
+    left = sent[channels[removed]]
+    print(f"hot swap: '{removed}' removed from live scene '{scene_name}', its channels now {left.tolist()}")
+    return not left.any()
+
+def cache_check(n_frames=20, scenes_directory='scenes', profiles_directory='profiles'):
+    """
+    Renders the same frames with every scene on every profile from plans compiled fresh, then from the scene cache
+    (written once, read back), and checks that the frames are equal.
+
+    Returns:
+    bool: Whether the check passed.
+    """
+    import palette
+    from scene_cache import SceneCache
+    from control import channel_layout
+    fft_frames = synthetic_fft(n_frames) * 50
+    directory = tempfile.mkdtemp()
+    mismatches, checked = [], 0
+    try:
+        SceneManager(scenes_directory, cache_directory=directory)  # warms the parsed scenes
+        profile_names = sorted(name[:-5] for name in os.listdir(profiles_directory) if name.endswith('.json'))
+        for profile_name in profile_names:
+            try:
+                profile = load_profile(profile_name)
+                layout = channel_layout(profile)
+            except ValueError:
+                continue
+            n_universes = len(universe_configs(profile))
+            fresh = SceneManager(scenes_directory, cache_directory=None)
+            for scene_name in fresh.scenes:
+                frames = []
+                for source in ('fresh', 'cold', 'warm'):
+                    # random colors are drawn both when compiling and when rendering
+                    palette.seed(0)
+                    if source == 'fresh':
+                        plan = fresh.compile(scene_name, layout)
+                    else:
+                        # a new SceneCache each time, so 'warm' reads the plan 'cold' pickled
+                        cache = SceneCache(directory)
+                        path = os.path.join(scenes_directory, scene_name + '.json')
+                        scene = cache.load_scene(path, cache.entries[path]['signature'])
+                        plan = cache.compile(path, scene, layout)
+                        cache.save()
+                    palette.seed(1)
+                    universe = np.zeros(n_universes * UNIVERSE_SIZE, dtype=np.uint8)
+                    rendered = np.zeros((n_frames, len(universe)), dtype=np.uint8)
+                    for i, fft_data in enumerate(fft_frames):
+                        plan.render(fft_data, universe, i / 4, i * 0.01)
+                        rendered[i] = universe
+                    frames.append(rendered)
+                checked += 1
+                if not (np.array_equal(frames[0], frames[1]) and np.array_equal(frames[0], frames[2])):
+                    mismatches.append(f'{scene_name}/{profile_name}')
+    finally:
+        shutil.rmtree(directory)
+    print(f"scene cache: {checked - len(mismatches)} of {checked} scene/profile pairs render the same from the cache"
+          + (f", differing: {', '.join(mismatches)}" if mismatches else ''))
+    return checked > 0 and not mismatches
+
+def compare(name, result, baseline):
+    """
+    Returns the status of a result against the baseline. Only the p50 can make it a regression, after scaling the
+    baseline up by how much slower the calibration frame ran than when the baseline was recorded; the p99 ratio is
+    shown as is.
+    """
+    if name not in baseline:
+        return 'new'
+    reference = baseline[name]
+    if reference['p50_us'] <= 0:
+        return 'ok'
+    speed = 1.0
+    if reference.get('calibration_us', 0) > 0 and result.get('calibration_us', 0) > 0:
+        # only ever allow for a slower machine: a calibration frame that happened to run fast shouldn't tighten
+        # the gate below the baseline itself
+        speed = max(result['calibration_us'] / reference['calibration_us'], 1.0)
+    status = f"{result['p50_us'] / (reference['p50_us'] * speed):.2f}x p50"
+    if reference['p99_us'] > 0:
+        status += f", {result['p99_us'] / reference['p99_us']:.2f}x p99"
+    if result['p50_us'] > REGRESSION_FACTOR * reference['p50_us'] * speed:
+        return 'REGRESSION ' + status
+    return status
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the per-frame light pipeline')
+    parser.add_argument('-n', '--frames', type=int, default=2000, help='Frames per benchmark')
+    parser.add_argument('-r', '--repeats', type=int, default=REPEATS, help='Timing passes per benchmark')
+    parser.add_argument('-k', '--filter', help='Only run benchmarks whose name contains this')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='Baseline file')
+    parser.add_argument('--save-baseline', action='store_true', help='Store the results as the new baseline')
+    parser.add_argument('--imports', action='store_true', help='Only check the cold import time of run_lights.py')
+    parser.add_argument('--playback', action='store_true', help='Only check the playback poller against a stub API')
+    parser.add_argument('--hot-swap', action='store_true', help='Only check that hot-reloading the live scene clears '
+                        'the channels it dropped')
+    parser.add_argument('--cache', action='store_true', help='Only check that cached plans render like fresh ones')
+    args = parser.parse_args()
+
+    if args.imports or args.playback or args.hot_swap or args.cache:
+        passed = True
+        if args.imports:
+            passed &= import_check()
+        if args.playback:
+            passed &= playback_check()
+        if args.hot_swap:
+            passed &= hot_swap_check()
+        if args.cache:
+            passed &= cache_check()
+        if not passed:
+            raise SystemExit(1)
+        return
+
+    audio_frames = synthetic_audio(256)
+    fft_frames = synthetic_fft(256)
+    benchmarks = {}
+    benchmarks.update(mapping_benchmarks(fft_frames))
+    benchmarks.update(audio_benchmarks(audio_frames))
+    controllers = {}
+    for scene_benchmarks, scene_controllers in (send_dynamic_benchmarks(fft_frames), transition_benchmarks(fft_frames)):
+        benchmarks.update(scene_benchmarks)
+        controllers.update(scene_controllers)
+    network_benchmarks, receivers = output_benchmarks()
+    benchmarks.update(network_benchmarks)
+    if args.filter:
+        benchmarks = {name: fn for name, fn in benchmarks.items() if args.filter in name}
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = 0
+    width = max(len(name) for name in benchmarks) if benchmarks else 0
+    print(f"{'benchmark':<{width}}  {'mean us':>9} {'p50 us':>9} {'p99 us':>9} {'alloc B':>9}  vs baseline")
+    for name, frame_fn in benchmarks.items():
+        result = measure(frame_fn, args.frames, repeats=args.repeats)
+        if name in controllers:
+            # its writer threads would otherwise keep waking up during the benchmarks after it
+            stop_controller(controllers.pop(name))
+        results[name] = result
+        status = compare(name, result, baseline)
+        regressions += status.startswith('REGRESSION')
+        print(f"{name:<{width}}  {result['mean_us']:9.1f} {result['p50_us']:9.1f} {result['p99_us']:9.1f} "
+              f"{result['alloc_bytes']:9.0f}  {status}")
+    for light_controller in controllers.values():
+        stop_controller(light_controller)
+    for receiver, outputs in receivers:
+        # let the receiver drain its socket before reading its counts
+        sent = sum(output.packets_sent for output in outputs)
+        receiver.wait_for(sent, timeout=1.0)
+        receiver.stop()
+        receiver.join()
+        for output in outputs:
+            output.close()
+        if receiver.packets:
+            print(f"{receiver.summary()}, {sent - receiver.packets} of {sent} sent packets lost")
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+        print(f"Saved baseline to {args.baseline}")
+    elif regressions:
+        print(f"{regressions} benchmark(s) regressed by more than {REGRESSION_FACTOR}x at p50")
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -8,149 +8,452 @@ Author: Landry Bulls
 Date: 8/20/24
 """
 
-from PyDMXControl.controllers import OpenDMXController
-from PyDMXControl.profiles.Generic import Dimmer, Custom
-from custom_profiles.RGB import RGB
-from custom_profiles.ADJ_strobe import Strobe
 import threading
 import queue
 import os
 import json
-from mapping import fft_to_rgb, fft_to_strobe, fft_to_dimmer, generate_RGB_signal, bool_rgb, time_dimmer, time_rgb, time_strobe
-from audio_listener import AudioListener
-from scene_manager import SceneManager
+import logging
+import numpy as np
 from utils import load_json 
+from outputs import UNIVERSE_SIZE, DEFAULT_REFRESH_RATE, UniverseWriter, open_output, universe_controller_class
+from scheduler import FrameScheduler
+from transitions import Transition, TRANSITIONS, DEFAULT_TRANSITION, DEFAULT_TRANSITION_MS
 import time
 
+SELF_TEST_MODES = ('off', 'parallel', 'chase')
+
+logger = logging.getLogger(__name__)
+
+# channel footprint of each fixture type when the profile doesn't give n_channels
+CHANNELS_PER_TYPE = {
+    'dimmer': 1,
+    'rgb': 6,
+    'strobe': 2,
+}
+
+# values written to a fixture's first channels to flash it during the startup check
+FLASH_VALUES = {
+    'dimmer': [255],
+    'rgb': [255, 255, 255, 255, 0, 0],
+    'strobe': [255, 255],
+}
+
+def __getattr__(name):
+    # `from control import UniverseDMXController` still works, it just triggers the import
+    if name == 'UniverseDMXController':
+        return universe_controller_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 def load_profile(profile_name):
     with open(f'profiles/{profile_name}.json', 'r') as f:
         profile = json.load(f)
     return profile
 
-def load_controller(profile):
-    controller = OpenDMXController()
-    control_dict = {}
-    curr_channel = 1
+def universe_configs(profile):
+    """
+    Returns the universe entries of a profile (see outputs.py), a single OpenDMX universe if it declares none.
+    """
+    return profile.get('universes') or [{}]
+
+def channel_layout(profile):
+    """
+    Assigns every light of a profile a start offset, packing them in profile order. Universes are laid out end to end,
+    so universe u starts at offset u * UNIVERSE_SIZE. A light with a "universe" key goes in that universe; the others
+    fill the universes in order, moving on to the next one when a light doesn't fit.
+
+    Returns:
+    dict: The 0-based start offset of each light by name.
+    """
+    n_universes = len(universe_configs(profile))
+    next_channel = [0] * n_universes
+    current = 0  # the universe unpinned lights are being packed into
+    layout = {}
     for light in profile['lights']:
-        if light['type'] == 'dimmer':
-            control_dict[light['name']] = controller.add_fixture(Dimmer(name=light['name'], start_channel=curr_channel))
-            # flash the light to make sure it's working
-            control_dict[light['name']].dim(255)
-            time.sleep(0.5)
-            control_dict[light['name']].dim(0)
-            curr_channel += 1
-        elif light['type'] == 'rgb':
-            control_dict[light['name']] = controller.add_fixture(RGB(name=light['name'], start_channel=curr_channel))
-            # flash the light to make sure it's working
-            control_dict[light['name']].set_channels([255,255,255,255,0,0])
-            time.sleep(0.5)
-            control_dict[light['name']].set_channels([0,0,0,0,0,0])
-            curr_channel += 6
-        elif light['type'] == 'strobe':
-            control_dict[light['name']] = controller.add_fixture(Strobe(name=light['name'], start_channel=curr_channel))
-            # flash the light to make sure it's working
-            control_dict[light['name']].set_channels([255,255])
-            time.sleep(0.5)
-            control_dict[light['name']].set_channels([0,0])
-            curr_channel += 2
-
-    return controller, control_dict
+        if light['type'] not in CHANNELS_PER_TYPE:
+            continue
+        n_channels = light.get('n_channels', CHANNELS_PER_TYPE[light['type']])
+        universe = light.get('universe')
+        if universe is None:
+            while current < n_universes - 1 and next_channel[current] + n_channels > UNIVERSE_SIZE:
+                current += 1
+            universe = current
+        elif not 0 <= universe < n_universes:
+            raise ValueError(f"Light '{light['name']}' is in universe {universe}, but the profile has {n_universes}")
+        if next_channel[universe] + n_channels > UNIVERSE_SIZE:
+            raise ValueError(f"Light '{light['name']}' does not fit in universe {universe} "
+                             f"({UNIVERSE_SIZE} channels, {n_universes} universes in the profile)")
+        layout[light['name']] = universe * UNIVERSE_SIZE + next_channel[universe]
+        next_channel[universe] += n_channels
+    return layout
+
+class SelfTest(threading.Thread):
+    """
+    Flashes the fixtures of a profile to check they respond, either all together in one frame ('parallel') or one
+    after another ('chase'), holding each flash for step seconds. It runs in the background so the controller can be
+    used straight away; the LightController holds its output back until done is set.
+    """
+    def __init__(self, writers, profile, layout, mode='chase', step=0.5):
+        if mode not in SELF_TEST_MODES:
+            raise ValueError(f"Self-test mode '{mode}' not found. Options are: {', '.join(SELF_TEST_MODES)}")
+        threading.Thread.__init__(self, daemon=True)
+        self.writers = writers
+        self.mode = mode
+        self.step = step
+        self.lights = [light for light in profile['lights'] if light['name'] in layout]
+        self.layout = layout
+        self.done = threading.Event()
+        self.stopped = threading.Event()
+        self.elapsed = None
+        if mode == 'off':
+            self.done.set()
+
+    def frames(self):
+        """
+        Returns the (universes, UNIVERSE_SIZE) frames to show, one per step.
+        """
+        flashes = []
+        for light in self.lights:
+            universes = np.zeros((len(self.writers), UNIVERSE_SIZE), dtype=np.uint8)
+            offset = self.layout[light['name']]
+            flash = FLASH_VALUES[light['type']]
+            universes.reshape(-1)[offset:offset + len(flash)] = flash
+            flashes.append(universes)
+        if self.mode == 'parallel' and flashes:
+            return [np.maximum.reduce(flashes)]
+        return flashes
+
+    def write(self, universes):
+        for writer, universe in zip(self.writers, universes):
+            writer.write(universe)
+
+    def run(self):
+        start = time.perf_counter()
+        for universes in self.frames():
+            self.write(universes)
+            if self.stopped.wait(self.step):
+                break
+        self.write(np.zeros((len(self.writers), UNIVERSE_SIZE), dtype=np.uint8))
+        self.elapsed = time.perf_counter() - start
+        logger.info(f"Self-test ({self.mode}) of {len(self.lights)} fixtures took {self.elapsed:.2f} s")
+        self.done.set()
+
+    def stop(self):
+        self.stopped.set()
+
+def load_controller(profile, self_test=None, step=None, outputs=None, error_queue=None, latency=None):
+    """
+    Opens the outputs of every universe, starts a writer thread for each and starts the fixture self-test in the
+    background.
+
+    Parameters:
+    profile (dict): The lighting profile.
+    self_test (str): One of SELF_TEST_MODES. Defaults to the profile's "self_test", or 'chase'.
+    step (float): Seconds per flash. Defaults to the profile's "self_test_step", or 0.5.
+    outputs (list): Already opened outputs, one per universe of the profile, instead of the profile's.
+    error_queue (queue.Queue): Where the writers report errors.
+    latency (LatencyTracker): Where the writers record the 'flush' stage.
+
+    Returns:
+    tuple: (writers, layout, self_test) where writers are the running UniverseWriters and self_test the SelfTest.
+    """
+    configs = universe_configs(profile)
+    if outputs is None:
+        outputs = [open_output(config) for config in configs]
+    elif len(outputs) != len(configs):
+        raise ValueError(f"Got {len(outputs)} outputs for a profile with {len(configs)} universes")
+    layout = channel_layout(profile)
+    writers = [UniverseWriter(output, i, error_queue, latency) for i, output in enumerate(outputs)]
+    for writer in writers:
+        writer.start()
+    mode = self_test or profile.get('self_test', 'chase')
+    step = step if step is not None else profile.get('self_test_step', 0.5)
+    test = SelfTest(writers, profile, layout, mode, step)
+    if mode != 'off':
+        test.start()
+    return writers, layout, test
 
 class LightController(threading.Thread):
-    def __init__(self, audio_listener, profile_name, scene_manager):
+    def __init__(self, audio_listener, profile_name, scene_manager, outputs=None, self_test=None,
+                 self_test_step=None, frame_rate=None):
+        """
+        Parameters:
+        audio_listener (AudioListener): Where FFT frames come from.
+        profile_name (str): The lighting profile in profiles/.
+        scene_manager (SceneManager): Holds the current scene.
+        outputs (list): Already opened OutputBackends, one per universe of the profile. If not given, the outputs the
+            profile declares are opened and the fixtures are self-tested.
+        self_test (str): The self-test mode ('off', 'parallel' or 'chase'), overriding the profile's.
+        self_test_step (float): Seconds per self-test flash, overriding the profile's.
+        frame_rate (float): Frames per second to send at, overriding the profile's "frame_rate" (default 44). At 0,
+            a frame is sent whenever an audio frame arrives instead.
+        """
+        start = time.perf_counter()
         threading.Thread.__init__(self)
         self.audio_listener = audio_listener
+        self.profile_name = profile_name
+        self.profile_path = f'profiles/{profile_name}.json'
         self.profile = load_profile(profile_name)
         self.light_names = [i['name'] for i in self.profile['lights']]
-        self.dmx_controller, self.controller_dict = load_controller(self.profile)
+        self.error_queue = queue.Queue()
+        if outputs is not None and self_test is None:
+            self_test = 'off'  # outputs handed in are usually not fixtures
+        self.writers, self.channel_layout, self.self_test = load_controller(self.profile, self_test, self_test_step,
+                                                                            outputs, self.error_queue,
+                                                                            audio_listener.latency)
+        # every modulator writes into universe, a flat view of all universes end to end; flush() hands each changed
+        # universe to its writer once per frame
+        self.universes = np.zeros((len(self.writers), UNIVERSE_SIZE), dtype=np.uint8)
+        self.universe = self.universes.reshape(-1)
+        self.sent_universes = np.zeros_like(self.universes)
+        self.frames_sent = 0
+        self.frames_skipped = 0
         self.scene_manager = scene_manager
+        self.scene_manager.bind_layout(self.channel_layout)
         self.running = threading.Event()
-        self.fft_data = None
-        self.scene_changed = threading.Event()
+        self.fft_data = np.zeros(audio_listener.stft.n_bins, dtype=np.float32)  # the scheduled loop reads into it
+        # (incoming plan, mode, duration in ms), staged by change_scene before the plan is published, so the frame
+        # that first renders the plan also starts its transition
+        self.pending_transition = None
+        self.transition = None  # the Transition in progress, only touched by the light thread
+        self.layout_changed = threading.Event()  # the light thread clears the universe at the next frame
+        self.plan = None  # the plan the last frame was rendered with, only touched by the light thread
+        self.wait_timeout = 0.1  # seconds to wait for a new FFT frame before checking for shutdown
+        self.idle_fraction = 0.0  # smoothed share of loop time spent waiting for audio or the next frame's deadline
+        if frame_rate is None:
+            frame_rate = self.profile.get('frame_rate', DEFAULT_REFRESH_RATE)
+        self.scheduler = FrameScheduler(frame_rate) if frame_rate else None
+        self.startup_time = time.perf_counter() - start  # seconds until the controller could take frames
+        logger.info(f"Light controller for '{profile_name}' ready in {self.startup_time * 1000:.0f} ms "
+                    f"({len(self.writers)} universe(s), self-test: {self.self_test.mode})")
+
+    def flush(self, universes=None, adc_time=None):
+        """
+        Hands every universe that changed since the last commit to its writer.
+
+        Parameters:
+        universes (np.array): The (universes, UNIVERSE_SIZE) frame to send, by default the universe buffer.
+        adc_time (float): The ADC time of the newest audio in the frame; the writers record the 'flush' latency
+            stage against it once the frame is out.
+
+        Returns:
+        bool: Whether a new frame was sent.
+        """
+        if not self.self_test.done.is_set():
+            return False  # the self-test has the output until it finishes
+        if universes is None:
+            universes = self.universes
+        changed = (universes != self.sent_universes).any(axis=1)
+        if not changed.any():
+            self.frames_skipped += 1
+            return False
+        self.sent_universes[:] = universes
+        for i in np.flatnonzero(changed):
+            # a copy per frame, so the writer never sees a half-written universe
+            self.writers[i].write(self.sent_universes[i].copy(), adc_time)
+        self.frames_sent += 1
+        return True
+
+    def reload_profile(self, path=None):
+        """
+        Re-reads the lighting profile and recompiles the current scene against its new layout. Meant to be called
+        from a SceneWatcher when the profile file changes. The universes and their outputs can't change while
+        running.
+        """
+        profile = load_profile(self.profile_name)
+        if len(universe_configs(profile)) != len(self.writers):
+            raise ValueError("The number of universes can't change while running, restart to apply it")
+        layout = channel_layout(profile)
+        self.scene_manager.bind_layout(layout)
+        self.profile, self.channel_layout = profile, layout
+        self.light_names = [i['name'] for i in profile['lights']]
+        self.layout_changed.set()
+
+    def format_startup(self):
+        line = f"Startup: controller ready in {self.startup_time * 1000:.0f} ms, self-test ({self.self_test.mode}) "
+        if self.self_test.mode == 'off':
+            return line + "skipped"
+        if self.self_test.elapsed is None:
+            return line + "running"
+        return line + f"took {self.self_test.elapsed:.2f} s"
+
+    def get_errors(self):
+        errors = []
+        while not self.error_queue.empty():
+            errors.append(self.error_queue.get_nowait())
+        return errors
 
     def turn_off_all_lights(self):
-        for light in self.profile['lights']:
-            if light['type'] == 'dimmer':
-                self.controller_dict[light['name']].dim(0)
-            elif light['type'] == 'rgb':
-                self.controller_dict[light['name']].set_channels([0,0,0,0,0,0])
-            elif light['type'] == 'strobe':
-                self.controller_dict[light['name']].set_channels([0,0])
-
-    def change_scene(self, scene_name):
-        # first turn off all the lights
-        self.turn_off_all_lights()
-        self.scene_manager.set_scene(scene_name)
-        self.scene_changed.set()
+        self.transition = None
+        self.universe[:] = 0
+        self.flush()
+
+    def change_scene(self, scene_name, transition=None, duration_ms=None):
+        """
+        Switches to another scene, blending over from the current one (see transitions.py).
+
+        Parameters:
+        scene_name (str): The scene to switch to.
+        transition (str): One of TRANSITIONS. Defaults to the incoming scene's "transition", then the profile's, then
+            a crossfade.
+        duration_ms (float): How long the transition takes. Defaults to the incoming scene's "transition_ms", then
+            the profile's, then 500.
+        """
+        if scene_name not in self.scene_manager.scenes:
+            raise ValueError(f"Scene '{scene_name}' not found")
+        scene = self.scene_manager.scenes[scene_name]
+        if transition is None:
+            transition = scene.get('transition', self.profile.get('transition', DEFAULT_TRANSITION))
+        if transition not in TRANSITIONS:
+            raise ValueError(f"Transition '{transition}' not found. Options are: {', '.join(TRANSITIONS)}")
+        if duration_ms is None:
+            duration_ms = scene.get('transition_ms', self.profile.get('transition_ms', DEFAULT_TRANSITION_MS))
+
+        def stage(plan):
+            self.pending_transition = (plan, transition, duration_ms)
+
+        self.scene_manager.set_scene(scene_name, before_publish=stage)
 
     def run(self):
         self.running.set()
+        if self.scheduler is not None:
+            self.run_scheduled()
+            return
+        last = time.perf_counter()
         while self.running.is_set():
-            if self.scene_changed.is_set():
-                #print(f"Changing to scene: {self.scene_manager.current_scene['name']}")
-                self.scene_changed.clear()
-                
-                # # Apply the new scene immediately
-                # if self.scene_manager.current_scene['type'] == 'static':
-                #     self.send_static()
-            
-            # if self.scene_manager.current_scene['type'] == 'dynamic':
-            if not self.audio_listener.fft_queue.empty():
+            # sleep until the audio listener publishes a frame instead of spinning on the buffer
+            has_frame = self.audio_listener.wait_for_fft(timeout=self.wait_timeout)
+            woke = time.perf_counter()
+            if has_frame:
                 try:
                     self.send_dynamic()
                 except Exception as e:
-                    print(f"Error sending dynamic data: {str(e)}")
-            # elif self.scene_manager.current_scene['type'] == 'static':
-            #     # For static scenes, we only need to update occasionally
-            #     time.sleep(0.1)  # Adjust this value as needed
-            
+                    self.error_queue.put(f"Error sending dynamic data: {str(e)}")
+            now = time.perf_counter()
+            if now > last:
+                idle = (woke - last) / (now - last)
+                self.idle_fraction += 0.05 * (idle - self.idle_fraction)
+            last = now
+
+    def run_scheduled(self):
+        last = time.perf_counter()
+        while self.running.is_set():
+            now = self.scheduler.wait()
+            woke = time.perf_counter()
+            try:
+                self.send_scheduled(now)
+            except Exception as e:
+                self.error_queue.put(f"Error sending dynamic data: {str(e)}")
+            # the share of each frame period spent asleep until the deadline
+            end = time.perf_counter()
+            if end > last:
+                idle = (woke - last) / (end - last)
+                self.idle_fraction += 0.05 * (idle - self.idle_fraction)
+            last = end
+
+    def begin_frame(self):
+        # the plan is swapped as a whole by set_scene, so take one reference for the whole frame
+        plan = self.scene_manager.current_plan
+        if plan is not self.plan:
+            pending = self.pending_transition
+            if pending is not None and pending[0] is plan:
+                # a scene change; the outgoing side is whatever the last frame rendered
+                _, mode, duration_ms = pending
+                if self.transition is not None:
+                    # a change in the middle of a transition fades out of the blend that was last sent, held still,
+                    # so the output doesn't jump to the interrupted transition's incoming scene
+                    outgoing, universes = None, self.sent_universes
+                else:
+                    outgoing, universes = self.plan, self.universes
+                self.transition = None
+                if mode != 'cut' and duration_ms > 0:
+                    self.transition = Transition(outgoing, universes, mode, duration_ms)
+            # the new plan (a new scene or a hot-reloaded one) starts from a dark universe, so channels only the old
+            # one drove don't stick
+            self.universe[:] = 0
+            self.plan = plan
+        if self.layout_changed.is_set():
+            # channels that no longer belong to a light would otherwise keep their last value
+            self.layout_changed.clear()
+            self.universe[:] = 0
+            self.transition = None
+        return plan
+
+    def output_frame(self, now):
+        """
+        Returns the frame to send at time now: the universe buffer, or during a transition its blend with the
+        outgoing scene's frame.
+        """
+        transition = self.transition
+        if transition is None:
+            return self.universes
+        universes = transition.blend(self.universes, now)
+        if transition.done(now):
+            self.transition = None
+        return universes
+
     def send_dynamic(self):
-        # Fetch FFT data once for all lights
-        try:
-            # get the most recent FFT data
-            fft_data = self.audio_listener.fft_queue.get_nowait()
-        except queue.Empty:
-            print("No FFT data available")
+        """
+        Renders and sends the newest audio frame at its ADC time, skipping any frames we fell behind on.
+        """
+        frame = self.audio_listener.fft_buffer.read_latest(consume=True)
+        if frame is None:
+            self.error_queue.put("No FFT data available")
             return
+        _, fft_data, adc_time = frame
+        plan = self.begin_frame()
+        latency = self.audio_listener.latency
+        if latency is not None:
+            latency.record('dequeue', adc_time)
 
-        for light in self.scene_manager.current_scene['lights']:
-            if light['name'] not in self.light_names:
-                continue  # Skip lights not in the profile
-
-            if light['modulator'] == 'fft':
-                if light['type'] == 'dimmer':
-                    dmx_value = fft_to_dimmer(fft_data, light['frequency_range'], light['power_range'], light['brightness_range'])
-                    self.controller_dict[light['name']].dim(dmx_value)
-                elif light['type'] == 'rgb':
-                    dmx_values = fft_to_rgb(fft_data, frange=light['frequency_range'], prange=light['power_range'], brange=light['brightness_range'], color=light['color'], strobe=light['strobe'])
-                    self.controller_dict[light['name']].set_channels(dmx_values)
-                elif light['type'] == 'strobe':
-                    dmx_values = fft_to_strobe(fft_data, light['frequency_range'], light['power_range'][0])
-                    self.controller_dict[light['name']].set_channels(dmx_values)
-
-            elif light['modulator'] == 'bool':
-                if light['type'] == 'dimmer':
-                    self.controller_dict[light['name']].dim(light['brightness'])
-                elif light['type'] == 'rgb':
-                    self.controller_dict[light['name']].set_channels(bool_rgb(light))
-                elif light['type'] == 'strobe':
-                    self.controller_dict[light['name']].set_channels(light['speed'], light['brightness'])
-
-            elif light['modulator'] == 'time':
-                try:
-                    if light['type'] == 'dimmer':
-                        self.controller_dict[light['name']].dim(time_dimmer(light))
-                    elif light['type'] == 'rgb':
-                        self.controller_dict[light['name']].set_channels(time_rgb(light))
-                    elif light['type'] == 'strobe':
-                        self.controller_dict[light['name']].set_channels(time_strobe(light))
-                except Exception as e:
-                    print(f"Error sending time data: {str(e)}")
+        beats = self.audio_listener.tempo.beats(adc_time)
+        plan.render(fft_data, self.universe, beats, adc_time)
+        transition = self.transition
+        if transition is not None and transition.plan is not None:
+            transition.plan.render(fft_data, transition.universe, beats, adc_time)
+        if latency is not None:
+            latency.record('mapping', adc_time)
+        self.flush(self.output_frame(adc_time), adc_time)
+
+    def send_scheduled(self, now):
+        """
+        Renders and sends the frame for time now (on time.monotonic()). Every audio frame that arrived since the last
+        one is fed to the audio lights in order; if none did, they hold their last values while the time and bool
+        lights keep moving.
+        """
+        plan = self.begin_frame()
+        transition = self.transition
+        outgoing = transition.plan if transition is not None else None
+        latency = self.audio_listener.latency
+        adc_time = None
+        while True:
+            frame = self.audio_listener.fft_buffer.read_next(out=self.fft_data)
+            if frame is None:
+                break
+            adc_time = frame[2]
+            if latency is not None:
+                latency.record('dequeue', adc_time)
+            plan.render_audio(self.fft_data, self.universe)
+            if outgoing is not None:
+                outgoing.render_audio(self.fft_data, transition.universe)
+
+        beats = self.audio_listener.tempo.beats(now)
+        plan.render_clock(self.universe, beats, now)
+        if outgoing is not None:
+            outgoing.render_clock(transition.universe, beats, now)
+        if latency is not None and adc_time is not None:
+            latency.record('mapping', adc_time)
+        self.flush(self.output_frame(now), adc_time)
 
     def stop(self):
         self.running.clear()
+        self.self_test.stop()
+        for writer in self.writers:
+            writer.stop()
 
 def main():
+    from audio_listener import AudioListener
+    from scene_manager import SceneManager
+
     audio_listener = AudioListener()  # Make sure this is imported or defined
     scene_manager = SceneManager('scenes')
     light_controller = LightController(audio_listener, 'testing', scene_manager)
@@ -0,0 +1,157 @@
+"""
+dmx_receiver.py
+
+Description: A minimal Art-Net / sACN receiver for testing the network outputs without a node. DMXReceiver listens on
+a UDP port, keeps the last frame of every universe it hears and counts packets, sequence gaps and malformed packets,
+so a run of the lights (or benchmark.py) can be checked and its packets/sec measured on localhost.
+
+Usage:
+    python dmx_receiver.py                       # Art-Net on 127.0.0.1:6454, prints packets/sec every second
+    python dmx_receiver.py --protocol sacn       # sACN on 127.0.0.1:5568 (point the output's host at it)
+"""
+
+import argparse
+import socket
+import threading
+import time
+import numpy as np
+from outputs import ARTNET_PORT, SACN_PORT, ARTNET_HEADER_SIZE, SACN_HEADER_SIZE
+
+PROTOCOLS = ('artnet', 'sacn')
+MAX_PACKET_SIZE = 1024
+
+def parse_artnet(packet):
+    """
+    Returns (universe, sequence, data) of an ArtDmx packet, or None if it isn't one.
+    """
+    if len(packet) < ARTNET_HEADER_SIZE or packet[:8] != b'Art-Net\x00' or packet[8:10] != b'\x00\x50':
+        return None
+    length = int.from_bytes(packet[16:18], 'big')
+    if len(packet) < ARTNET_HEADER_SIZE + length:
+        return None
+    universe = packet[14] | packet[15] << 8
+    return universe, packet[12], packet[ARTNET_HEADER_SIZE:ARTNET_HEADER_SIZE + length]
+
+def parse_sacn(packet):
+    """
+    Returns (universe, sequence, data) of an E1.31 data packet, or None if it isn't one.
+    """
+    if len(packet) < SACN_HEADER_SIZE or packet[4:16] != b'ASC-E1.17\x00\x00\x00' or packet[125] != 0:
+        return None
+    length = int.from_bytes(packet[123:125], 'big') - 1  # the count includes the start code
+    if len(packet) < SACN_HEADER_SIZE + length:
+        return None
+    universe = int.from_bytes(packet[113:115], 'big')
+    return universe, packet[111], packet[SACN_HEADER_SIZE:SACN_HEADER_SIZE + length]
+
+PARSERS = {'artnet': parse_artnet, 'sacn': parse_sacn}
+DEFAULT_PORTS = {'artnet': ARTNET_PORT, 'sacn': SACN_PORT}
+
+class DMXReceiver(threading.Thread):
+    def __init__(self, protocol='artnet', host='127.0.0.1', port=None):
+        """
+        Parameters:
+        protocol (str): 'artnet' or 'sacn'.
+        host (str): The address to listen on.
+        port (int): The UDP port. Defaults to the protocol's; 0 picks a free one (see the port attribute).
+        """
+        if protocol not in PROTOCOLS:
+            raise ValueError(f"Protocol '{protocol}' not found. Options are: {', '.join(PROTOCOLS)}")
+        threading.Thread.__init__(self, daemon=True)
+        self.protocol = protocol
+        self.parse = PARSERS[protocol]
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.socket.bind((host, DEFAULT_PORTS[protocol] if port is None else port))
+        self.socket.settimeout(0.1)
+        self.host, self.port = self.socket.getsockname()
+        self.frames = {}  # universe -> last np.uint8 frame
+        self.sequences = {}  # universe -> last sequence number
+        self.packets = 0
+        self.gaps = 0  # packets missing or out of order according to the sequence numbers
+        self.malformed = 0
+        self.started_at = None
+        self.last_packet_at = None
+        self.stopped = threading.Event()
+
+    def receive(self, packet):
+        parsed = self.parse(packet)
+        if parsed is None:
+            self.malformed += 1
+            return
+        universe, sequence, data = parsed
+        previous = self.sequences.get(universe)
+        if previous is not None and sequence != 0 and sequence != self.expected_sequence(previous):
+            self.gaps += 1
+        self.sequences[universe] = sequence
+        self.frames[universe] = np.frombuffer(data, dtype=np.uint8).copy()
+        self.packets += 1
+        self.last_packet_at = time.perf_counter()
+        if self.started_at is None:
+            self.started_at = self.last_packet_at
+
+    def expected_sequence(self, previous):
+        if self.protocol == 'artnet':
+            return previous % 255 + 1  # Art-Net skips 0
+        return (previous + 1) & 0xFF
+
+    def run(self):
+        buffer = bytearray(MAX_PACKET_SIZE)
+        while not self.stopped.is_set():
+            try:
+                n = self.socket.recv_into(buffer)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.receive(bytes(buffer[:n]))
+        self.socket.close()
+
+    def packets_per_second(self):
+        if self.started_at is None or self.last_packet_at == self.started_at:
+            return 0.0
+        return (self.packets - 1) / (self.last_packet_at - self.started_at)
+
+    def wait_for(self, packets, timeout=1.0):
+        """
+        Waits until at least packets packets have arrived, or timeout seconds.
+
+        Returns:
+        bool: Whether they arrived.
+        """
+        deadline = time.perf_counter() + timeout
+        while self.packets < packets:
+            if time.perf_counter() > deadline:
+                return False
+            time.sleep(0.001)
+        return True
+
+    def summary(self):
+        return (f"{self.protocol} on {self.host}:{self.port}: {self.packets} packets "
+                f"({self.packets_per_second():.0f}/s), {self.gaps} sequence gaps, {self.malformed} malformed, "
+                f"universes {sorted(self.frames)}")
+
+    def stop(self):
+        self.stopped.set()
+
+def main():
+    parser = argparse.ArgumentParser(description='Receive Art-Net or sACN on this machine and count the packets')
+    parser.add_argument('--protocol', choices=PROTOCOLS, default='artnet')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, help="UDP port (default: the protocol's)")
+    args = parser.parse_args()
+
+    receiver = DMXReceiver(args.protocol, args.host, args.port)
+    receiver.start()
+    print(f"Listening for {args.protocol} on {receiver.host}:{receiver.port}, Ctrl-C to stop")
+    try:
+        while True:
+            time.sleep(1)
+            print(receiver.summary())
+    except KeyboardInterrupt:
+        pass
+    receiver.stop()
+    receiver.join()
+
+if __name__ == '__main__':
+    main()
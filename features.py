@@ -0,0 +1,113 @@
+"""
+Provides the mel filterbank, the DCT matrix and the MelFeatures class, which turns STFT magnitude frames into mel band
+energies and MFCCs. Both matrices are built once at startup, so each frame costs a matrix multiply, a log and a
+second small matrix multiply, and librosa is never called on the live path.
+
+Mel energies here are weighted means of the FFT magnitude under each (area-normalized) triangular filter, which puts
+them on the same scale as the frequency_range means the scenes already use, so a scene can swap a frequency_range for
+a mel band and keep its power_range.
+"""
+
+import numpy as np
+from config import audio_parameters
+
+SAMPLERATE = audio_parameters['SAMPLERATE']
+WINDOW_LENGTH = audio_parameters['WINDOW_LENGTH']
+N_MELS = audio_parameters['N_MELS']
+N_MFCC = audio_parameters['N_MFCC']
+
+def hz_to_mel(freq):
+    return 2595.0 * np.log10(1.0 + np.asarray(freq, dtype=np.float64) / 700.0)
+
+def mel_to_hz(mel):
+    return 700.0 * (10.0 ** (np.asarray(mel, dtype=np.float64) / 2595.0) - 1.0)
+
+def mel_filterbank(sample_rate=SAMPLERATE, n_fft=WINDOW_LENGTH, n_mels=N_MELS, fmin=0.0, fmax=None):
+    """
+    Builds triangular mel filters over the bins of an n_fft-point real FFT.
+
+    Parameters:
+    sample_rate (int): The sample rate of the audio.
+    n_fft (int): The FFT size.
+    n_mels (int): The number of mel bands.
+    fmin (float): The lower edge of the first band in Hz.
+    fmax (float): The upper edge of the last band in Hz. Defaults to the Nyquist frequency.
+
+    Returns:
+    np.array: An (n_mels, n_fft // 2 + 1) float32 matrix whose rows each sum to 1.
+    """
+    if fmax is None:
+        fmax = sample_rate / 2
+    if fmax > sample_rate / 2:
+        raise ValueError(f"Frequency {fmax} Hz is above the Nyquist frequency {sample_rate/2} Hz")
+    bin_freqs = np.arange(n_fft // 2 + 1) * sample_rate / n_fft
+    edges = mel_to_hz(np.linspace(hz_to_mel(fmin), hz_to_mel(fmax), n_mels + 2))
+    lower, center, upper = edges[:-2, None], edges[1:-1, None], edges[2:, None]
+    rising = (bin_freqs - lower) / (center - lower)
+    falling = (upper - bin_freqs) / (upper - center)
+    filters = np.maximum(0.0, np.minimum(rising, falling))
+    # low bands can be narrower than one bin; give them the nearest bin so no row is empty
+    for i in np.flatnonzero(filters.sum(axis=1) == 0):
+        filters[i, np.argmin(np.abs(bin_freqs - center[i, 0]))] = 1.0
+    filters /= filters.sum(axis=1, keepdims=True)
+    return filters.astype(np.float32)
+
+def dct_matrix(n_mfcc=N_MFCC, n_mels=N_MELS):
+    """
+    Returns the (n_mfcc, n_mels) orthonormal DCT-II matrix that turns log mel energies into MFCCs.
+    """
+    n = np.arange(n_mels)
+    k = np.arange(n_mfcc)[:, None]
+    dct = np.cos(np.pi / n_mels * (n + 0.5) * k) * np.sqrt(2.0 / n_mels)
+    dct[0] /= np.sqrt(2.0)
+    return dct.astype(np.float32)
+
+_default_filterbank = None
+
+def default_filterbank():
+    """
+    Returns the filterbank for the configured SAMPLERATE, WINDOW_LENGTH and N_MELS, building it on first use.
+    """
+    global _default_filterbank
+    if _default_filterbank is None:
+        _default_filterbank = mel_filterbank()
+    return _default_filterbank
+
+def mel_band_weights(bands):
+    """
+    Returns the bin weights of one mel band (an index) or the average of a [first, last) range of mel bands.
+    """
+    filterbank = default_filterbank()
+    if isinstance(bands, int):
+        if not 0 <= bands < len(filterbank):
+            raise ValueError(f"Mel band {bands} out of range, there are {len(filterbank)}")
+        return filterbank[bands]
+    first, last = bands
+    if not 0 <= first < last <= len(filterbank):
+        raise ValueError(f"Mel band range {bands} out of range, there are {len(filterbank)}")
+    return filterbank[first:last].mean(axis=0)
+
+class MelFeatures:
+    def __init__(self, sample_rate=SAMPLERATE, n_fft=WINDOW_LENGTH, n_mels=N_MELS, n_mfcc=N_MFCC, eps=1e-6):
+        if sample_rate == SAMPLERATE and n_fft == WINDOW_LENGTH and n_mels == N_MELS:
+            self.filterbank = default_filterbank()
+        else:
+            self.filterbank = mel_filterbank(sample_rate, n_fft, n_mels)
+        self.dct = dct_matrix(n_mfcc, n_mels)
+        self.eps = eps
+        self.mel = np.zeros(n_mels, dtype=np.float32)
+        self.mfcc = np.zeros(n_mfcc, dtype=np.float32)
+        self._log_mel = np.zeros(n_mels, dtype=np.float32)
+
+    def process(self, magnitude):
+        """
+        Computes the mel energies and MFCCs of one magnitude frame. The returned arrays are reused by the next call.
+
+        Returns:
+        tuple: (mel, mfcc)
+        """
+        np.dot(self.filterbank, magnitude, out=self.mel)
+        np.add(self.mel, self.eps, out=self._log_mel)
+        np.log(self._log_mel, out=self._log_mel)
+        np.dot(self.dct, self._log_mel, out=self.mfcc)
+        return self.mel, self.mfcc
@@ -0,0 +1,80 @@
+"""
+Provides low-overhead latency histograms for following a frame from the moment its audio hit the ADC to the moment
+its DMX values were flushed.
+
+Every stage records the time elapsed since the frame's ADC timestamp, so the numbers for later stages include the
+earlier ones and read directly as "how far behind the music is this stage".
+"""
+
+import time
+import numpy as np
+
+# stages in pipeline order
+STAGES = ('fft', 'dequeue', 'mapping', 'flush')
+
+class LatencyHistogram:
+    """
+    Fixed-width bins from 0 to max_ms, plus an overflow bin. Recording is a couple of integer operations, so it is
+    cheap enough to call for every frame.
+    """
+    def __init__(self, max_ms=500.0, resolution_ms=0.1):
+        self.resolution_ms = resolution_ms
+        self.n_bins = int(round(max_ms / resolution_ms))
+        self._scale = 1000.0 / resolution_ms
+        self.counts = [0] * (self.n_bins + 1)
+        self.total = 0
+
+    def record(self, seconds):
+        idx = int(seconds * self._scale)
+        if idx < 0:
+            idx = 0
+        elif idx > self.n_bins:
+            idx = self.n_bins
+        self.counts[idx] += 1
+        self.total += 1
+
+    def percentile(self, q):
+        """
+        Returns the q-th percentile in milliseconds (upper edge of its bin), or None if nothing was recorded.
+        """
+        if self.total == 0:
+            return None
+        cumulative = np.cumsum(self.counts)
+        idx = int(np.searchsorted(cumulative, q / 100 * self.total))
+        return (idx + 1) * self.resolution_ms
+
+    def reset(self):
+        self.counts = [0] * (self.n_bins + 1)
+        self.total = 0
+
+class LatencyTracker:
+    def __init__(self, stages=STAGES, max_ms=500.0, resolution_ms=0.1):
+        self.histograms = {stage: LatencyHistogram(max_ms, resolution_ms) for stage in stages}
+
+    def record(self, stage, adc_time, now=None):
+        """
+        Records how long after adc_time (a time.monotonic() timestamp) a frame reached a stage.
+        """
+        if now is None:
+            now = time.monotonic()
+        self.histograms[stage].record(now - adc_time)
+
+    def summary(self):
+        """
+        Returns:
+        dict: (count, p50 ms, p99 ms) for every stage.
+        """
+        return {stage: (hist.total, hist.percentile(50), hist.percentile(99)) for stage, hist in self.histograms.items()}
+
+    def reset(self):
+        for hist in self.histograms.values():
+            hist.reset()
+
+    def format(self):
+        lines = []
+        for stage, (count, p50, p99) in self.summary().items():
+            if count == 0:
+                lines.append(f"{stage:<8} no frames yet")
+            else:
+                lines.append(f"{stage:<8} p50 {p50:6.1f} ms  p99 {p99:6.1f} ms  ({count} frames)")
+        return lines
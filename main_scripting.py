@@ -40,6 +40,8 @@ import threading
 import matplotlib.pyplot as plt
 import threading
 import pickle
+from playback import PlaybackService
+from track_index import TrackIndex
 
 get_ipython().run_line_magic('matplotlib', 'inline')
 
@@ -333,8 +335,13 @@ class Pulser(object):
     def __init__(self):
         self._running = False
         self.last_song = None
-        self.df = pd.read_csv('elm_tracks.csv')
+        # track id -> scene, cluster and features; built from the playlist CSV the first time
+        self.tracks = TrackIndex('tracks.db')
+        if len(self.tracks) == 0 and os.path.exists('elm_tracks.csv'):
+            self.tracks.import_csv('elm_tracks.csv')
         self.scene_controller = None
+        # one poller for the playback state, which sleeps until the current track is about to end
+        self.playback = PlaybackService(token)
         self.dmx = OpenDMXController()
         self.SAMPLERATE = 16000
         self.MINIMUM_FREQUENCY = 20
@@ -624,12 +631,14 @@ class Pulser(object):
 
     def start(self):
         self._running = True
+        self.playback.start()
+        self.playback.get_event(timeout=5)  # the first event is the track playing now
         self.current_song = self.get_current_song()
         self.cur_genre = sp.artist(sp.track(self.current_song)['artists'][0]['id'])['genres'][0]
-        # check if song is in the dataframe
-        if self.current_song in self.df['id'].values:
+        # check if song has a scene in the index; tracks added from an unlabelled CSV or by clustering don't
+        if self.tracks.scene(self.current_song) is not None:
             self.last_song = self.current_song
-            self.current_scene = self.df[self.df['id'] == self.current_song]['scene'].values[0]
+            self.current_scene = self.tracks.scene(self.current_song)
             self.pulse()
         else:
             # get the artists of the current song
@@ -642,10 +651,13 @@ class Pulser(object):
             genres = ', '.join(genres)
             # get the cluster by embedding and fitting
             cluster = self.model.predict(self.model.embed([genres]))[0]
+            self.tracks.add(self.current_song, cluster=cluster)
             # get the scene associated with each cluster
 
     def get_current_song(self):
-        self.current_song = sp.current_user_playing_track()['item']['id']
+        # the playback service keeps the latest state, so this doesn't make a request
+        self.current_song = self.playback.track_id
+        return self.current_song
 
     def run_scene(self, scene_dict):
         scene = self.scene(scene_dict)
@@ -663,21 +675,23 @@ class Pulser(object):
         self.scene_thread = threading.Thread(target=self.run)
     
     def get_scene(self, song_id):
-        # check if song is in the dataframe
-        if song_id in self.df['id'].values:
-            return self.df[self.df['id'] == song_id]['scene'].values[0]
+        # check if song has a scene in the index
+        if self.tracks.scene(song_id) is not None:
+            return self.tracks.scene(song_id)
         else:
             # estimate the scene based on genre
     
     def terminate(self):
         self._running = False
+        self.playback.stop()
     
     def run(self):
         while self._running:
-            current_song = self.get_current_song()
-            if current_song != self.last_song:
-                self.last_song = current_song
+            event = self.playback.get_event(timeout=1)
+            if event is None or event['track_id'] is None:
+                continue
+            if event['track_id'] != self.last_song:
+                self.current_song = self.last_song = event['track_id']
                 self.pulse()
-            time.sleep(1)
 
 
@@ -11,44 +11,110 @@ from config import audio_parameters
 import numpy as np
 import time
 from math import sin, pi
+from wavetable import wave_level
+from palette import PALETTE, color_index, random_colors, random_values, random_color_name, fade_color, fade_rate
 
 SAMPLERATE = audio_parameters['SAMPLERATE']
 BLOCKSIZE = audio_parameters['BLOCKSIZE']
-
-# these are DMX colors
-colors = {
-    'red': [255, 0, 0],
-    'orange': [255, 127, 0],
-    'yellow': [255, 255, 0],
-    'green': [0, 255, 0],
-    'blue': [0, 0, 255],
-    'purple': [75, 0, 130],
-    'pink': [255, 0, 255],
-    'white': [255, 255, 255]
-}
+WINDOW_LENGTH = audio_parameters['WINDOW_LENGTH']  # the FFT size, which sets the bin spacing
 
 def random_color():
     """
     Returns a random color from the color wheel
     """
-    return np.random.choice(list(colors.keys()))
+    return random_color_name()
 
 def generate_RGB_signal(brightness=255, color='pink', strobe=0, colorfade=0):
     """
-    Returns the list of 7 DMX values for the RGB light
+    Returns the list of 6 DMX values for the RGB light
     """
-    if strobe=='random':
-        strobe_val = np.random.randint(0, 255)
-    if color == 'random':
-        color = random_color()
+    if strobe == 'random':
+        strobe = int(random_values(1)[0])
+    if colorfade:
+        red, green, blue = fade_color(time.time() * fade_rate(colorfade)).tolist()
+    elif color == 'random':
+        red, green, blue = random_colors(1)[0].tolist()
     else:
-        color = colors[color]
-    return [brightness, color[0], color[1], color[2], strobe_val, 0]
+        red, green, blue = PALETTE[color_index(color)].tolist()
+    return [brightness, red, green, blue, strobe, 0]
 
 def freq_to_index(freq):
     if freq > SAMPLERATE / 2:
         raise ValueError(f"Frequency {freq} Hz is above the Nyquist frequency {SAMPLERATE/2} Hz")
-    return int(freq * BLOCKSIZE / SAMPLERATE)
+    return int(freq * WINDOW_LENGTH / SAMPLERATE)
+
+class BandEnergy:
+    """
+    Computes the mean FFT power in a fixed set of bands in one pass per FFT frame. Frequency ranges use a
+    cumulative-sum table so the cost stays flat no matter how many (possibly overlapping) ranges there are; weighted
+    bands (such as mel filters) are done together in one matrix-vector product.
+    """
+    def __init__(self, bands, n_bins=WINDOW_LENGTH // 2 + 1):
+        """
+        Parameters:
+        bands (list): For each band, either a [low, high] frequency range in Hz or an array of n_bins weights
+            summing to 1 (see features.mel_band_weights).
+        n_bins (int): The length of the FFT vectors that will be passed in.
+        """
+        ranges, weights = [], []
+        band_keys = []
+        for band in bands:
+            if len(band) == 2:
+                low, high = freq_to_index(band[0]), freq_to_index(band[1])
+                # an empty range would average to nan, so always cover at least one bin
+                bound = (min(low, n_bins - 1), min(max(high, low + 1), n_bins))
+                # bands that share a range are only computed once
+                if bound not in ranges:
+                    ranges.append(bound)
+                band_keys.append(('range', ranges.index(bound)))
+            else:
+                if len(band) != n_bins:
+                    raise ValueError(f"Band weights have {len(band)} bins, expected {n_bins}")
+                weights.append(np.asarray(band, dtype=np.float64))
+                band_keys.append(('weights', len(weights) - 1))
+        self.bin_low = np.array([low for low, _ in ranges], dtype=np.intp)
+        self.bin_high = np.array([high for _, high in ranges], dtype=np.intp)
+        self.bin_count = (self.bin_high - self.bin_low).astype(np.float64)
+        self.weights = np.array(weights, dtype=np.float64).reshape(len(weights), n_bins)
+        # range means come first in _means, then the weighted bands
+        self.band_index = np.array([i if kind == 'range' else len(ranges) + i for kind, i in band_keys], dtype=np.intp)
+        self.n_bins = n_bins
+        self._cumulative = np.zeros(n_bins + 1, dtype=np.float64)
+        self._means = np.zeros(len(ranges) + len(weights), dtype=np.float64)
+        self._out = np.zeros(len(bands), dtype=np.float32)
+        self._bind_views()
+
+    def _bind_views(self):
+        # the range and weighted means are written straight into _means through these views
+        self._range_means = self._means[:len(self.bin_low)]
+        self._weighted_means = self._means[len(self.bin_low):]
+
+    def __getstate__(self):
+        # pickling would copy the views into arrays of their own, detached from _means
+        state = dict(self.__dict__)
+        del state['_range_means'], state['_weighted_means']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._bind_views()
+
+    def __len__(self):
+        return len(self._out)
+
+    def __call__(self, fft_vec):
+        """
+        Returns the mean of fft_vec over every band. The returned array is reused by the next call.
+        """
+        fft_vec = fft_vec[:self.n_bins]
+        if len(self.bin_low):
+            np.cumsum(fft_vec, out=self._cumulative[1:])
+            np.subtract(self._cumulative[self.bin_high], self._cumulative[self.bin_low], out=self._range_means)
+            self._range_means /= self.bin_count
+        if len(self.weights):
+            np.dot(self.weights, fft_vec, out=self._weighted_means)
+        np.take(self._means, self.band_index, out=self._out)
+        return self._out
 
 def power_to_brightness(power, lower_threshold, upper_threshold, min_brightness=0, max_brightness=255):
     """
@@ -71,6 +137,24 @@ def power_to_brightness(power, lower_threshold, upper_threshold, min_brightness=
     else:
         return int((power - lower_threshold) / (upper_threshold - lower_threshold) * (max_brightness - min_brightness) + min_brightness)
 
+def powers_to_brightness(powers, lower_thresholds, upper_thresholds, min_brightness, max_brightness):
+    """
+    Vectorized version of power_to_brightness for a whole array of lights at once.
+
+    Parameters:
+    powers (np.array): The power value of each light.
+    lower_thresholds (np.array): The power under which each light uses its minimum brightness.
+    upper_thresholds (np.array): The power over which each light uses its maximum brightness.
+    min_brightness (np.array): The minimum brightness of each light.
+    max_brightness (np.array): The maximum brightness of each light.
+
+    Returns:
+    np.array: The integer brightness value of each light.
+    """
+    span = np.maximum(upper_thresholds - lower_thresholds, np.finfo(np.float64).tiny)
+    level = np.clip((powers - lower_thresholds) / span, 0.0, 1.0)
+    return (level * (max_brightness - min_brightness) + min_brightness).astype(np.int64)
+
 def fft_to_rgb(fft_vec, frange=[0,2000], prange=[1.0, 15.0], brange=[0,255], color='random', strobe=0):
     """
     Converts an FFT vector to a set of DMX values to activate an RGB fixture. 
@@ -93,10 +177,11 @@ def fft_to_rgb(fft_vec, frange=[0,2000], prange=[1.0, 15.0], brange=[0,255], col
     brightness = power_to_brightness(fft_mean, prange[0], prange[1], brange[0], brange[1])
 
     if color == 'random':
-        color = random_color()
-    color = colors[color]
+        red, green, blue = random_colors(1)[0].tolist()
+    else:
+        red, green, blue = PALETTE[color_index(color)].tolist()
     
-    return [brightness, color[0], color[1], color[2], strobe, 0]
+    return [brightness, red, green, blue, strobe, 0]
 
 def fft_to_dimmer(fft_vec, frange, prange=[0.5,1.0], brange=[0,255]):
     """
@@ -146,152 +231,80 @@ def fft_to_strobe(fft_vec, frange, lower_threshold=0.5):
 
 def bool_rgb(light):
     """
-    Returns the DMX value for a static dimmer light
+    Returns the DMX value for a static RGB light. A light with a colorfade (0-255) fades through the palette at that
+    speed instead of holding one color.
     """
-    if 'colorfade' in light:
-        color = [0, 0, 0]
-        colorfade = light['colorfade']
-    else:
-        if light['color']=='random':
-            color = colors[random_color()]
-        else:
-            color = colors[light['color']]
-        colorfade = 0
-
-    if 'strobe' in light:
-        strobe = light['strobe']
-        if strobe=='random':
-            strobe = np.random.randint(0, 255)
-    else:
-        strobe = 0
-
     brightness = light['brightness']
-    if light['brightness']=='random':
-        brightness = np.random.randint(0, 255)
-    
-    return [brightness, color[0], color[1], color[2], strobe, colorfade]
+    if brightness == 'random':
+        brightness = int(random_values(1)[0])
+    return generate_RGB_signal(brightness, light.get('color', 'random'), light.get('strobe', 0), light.get('colorfade', 0))
 
 def bool_strobe(light):
     """
     Returns the DMX value for a static strobe light
     """
-    if light['speed'] == 'random':
-        speed = np.random.randint(0, 255)
+    speed, brightness = light['speed'], light['brightness']
+    if speed == 'random':
+        speed = int(random_values(1)[0])
 
-    if light['brightness'] == 'random':
-        brightness = np.random.randint(0, 255)
+    if brightness == 'random':
+        brightness = int(random_values(1)[0])
 
     return [speed, brightness]
 
-def time_dimmer(light):
+def time_level(light, now=None):
+    """
+    Returns the level (0 to 1) of a time-based light's wave at the current time, with its frequency in Hz. Scenes
+    evaluate all their time lights at once through wavetable.Oscillators; this is the one-light version.
+    """
+    if now is None:
+        now = time.time()
+    return wave_level(light['function'], now * light['frequency'])
+
+def time_dimmer(light, now=None):
     """
     Returns the DMX value for a time-based dimmer light based on the current time in seconds. 
     """
-    amplitude = (light['max_brightness'] - light['min_brightness']) / 2
-    midpoint = (light['max_brightness'] + light['min_brightness']) / 2
-    if light['function'] == 'sine':
-        return int(np.sin(time.time() * light['frequency']) * amplitude + midpoint)
-    elif light['function'] == 'square':
-        return int(np.sign(np.sin(time.time() * light['frequency'])) * amplitude + midpoint)
-    elif light['function'] == 'triangle':
-        return int(np.abs(np.sin(time.time() * light['frequency'])) * amplitude + midpoint)
-    elif light['function'] == 'sawtooth_forward':
-        return int((time.time() * light['frequency'] % 1) * amplitude + midpoint)
-    elif light['function'] == 'sawtooth_backward':
-        return int((1 - time.time() * light['frequency'] % 1) * amplitude + midpoint)
-
-def time_rgb(light):
+    level = time_level(light, now)
+    return int(light['min_brightness'] + (light['max_brightness'] - light['min_brightness']) * level)
+
+def time_rgb(light, now=None):
     """
     Returns the DMX value for a time-based RGB light based on the current time in seconds. 
     """
-    min_brightness = light['min_brightness']
-    max_brightness = light['max_brightness']
-    range_brightness = max_brightness - min_brightness
-    
-    if light['function'] == 'sine':
-        brightness = int(min_brightness + range_brightness * (np.sin(time.time() * light['frequency']*2*pi) * 0.5 + 0.5))
-    elif light['function'] == 'square':
-        brightness = int(min_brightness + range_brightness * (np.sign(np.sin(time.time() * light['frequency']*2*pi)) * 0.5 + 0.5))
-    elif light['function'] == 'triangle':
-        brightness = int(min_brightness + range_brightness * np.abs(((time.time() * light['frequency']) % 2) - 1))
-    elif light['function'] == 'sawtooth_forward':
-        brightness = int(min_brightness + range_brightness * ((time.time() * light['frequency']) % 1))
-    elif light['function'] == 'sawtooth_backward':
-        brightness = int(min_brightness + range_brightness * (1 - (time.time() * light['frequency'] % 1)))
+    level = time_level(light, now)
+    brightness = int(light['min_brightness'] + (light['max_brightness'] - light['min_brightness']) * level)
 
     if light['color'] == 'random':
-        color = colors[random_color()]
+        red, green, blue = random_colors(1)[0].tolist()
     else:
-        color = colors[light['color']]
+        red, green, blue = PALETTE[color_index(light['color'])].tolist()
 
     strobe = light.get('strobe', 0)
     if strobe == 'random':
-        strobe = np.random.randint(0, 255)
+        strobe = int(random_values(1)[0])
 
-    return [brightness, color[0], color[1], color[2], strobe, 0]
+    return [brightness, red, green, blue, strobe, 0]
 
-def time_strobe(light):
+def time_strobe(light, now=None):
     """
-    Returns the DMX value for a time-based strobe light based on the current time in seconds. 
+    Returns the DMX value for a time-based strobe light based on the current time in seconds. The light's target
+    ('speed', 'brightness' or 'both') says which channels follow the wave; the others keep their fixed value.
     """
-    speed_range = light['speed_range'][1] - light['speed_range'][0]
-    brightness_range = light['brightness_range'][1] - light['brightness_range'][0]
-    if light['target'] == 'speed':
-        amplitude = speed_range / 2
-        midpoint = (light['speed_range'][1] + light['speed_range'][0]) / 2
-        if light['function'] == 'sine':
-            speed = int(np.sin(time.time() * light['frequency']) * amplitude + midpoint)
-        elif light['function'] == 'square':
-            speed = int(np.sign(np.sin(time.time() * light['frequency'])) * amplitude + midpoint)
-        elif light['function'] == 'triangle':
-            speed = int(np.abs(np.sin(time.time() * light['frequency'])) * amplitude + midpoint)
-        elif light['function'] == 'sawtooth_forward':
-            speed = int((time.time() * light['frequency'] % 1) * amplitude + midpoint)
-        elif light['function'] == 'sawtooth_backward':
-            speed = int((1 - time.time() * light['frequency'] % 1) * amplitude + midpoint)
-        return [speed, light['brightness']]
-
-    elif light['target'] == 'brightness':
-        amplitude = brightness_range / 2
-        midpoint = (light['brightness_range'][1] + light['brightness_range'][0]) / 2
-        if light['function'] == 'sine':
-            brightness = int(np.sin(time.time() * light['frequency']) * amplitude + midpoint)
-        elif light['function'] == 'square':
-            brightness = int(np.sign(np.sin(time.time() * light['frequency'])) * amplitude + midpoint)
-        elif light['function'] == 'triangle':
-            brightness = int(np.abs(np.sin(time.time() * light['frequency'])) * amplitude + midpoint)
-        elif light['function'] == 'sawtooth_forward':
-            brightness = int((time.time() * light['frequency'] % 1) * amplitude + midpoint)
-        elif light['function'] == 'sawtooth_backward':
-            brightness = int((1 - time.time() * light['frequency'] % 1) * amplitude + midpoint)
-        return [light['speed'], brightness]
-
-    elif light['target'] == 'both':
-        speed_amplitude = speed_range / 2
-        speed_midpoint = (light['speed_range'][1] + light['speed_range'][0]) / 2
-        brightness_amplitude = brightness_range / 2
-        brightness_midpoint = (light['brightness_range'][1] + light['brightness_range'][0]) / 2
-        if light['function'] == 'sine':
-            speed = int(np.sin(time.time() * light['frequency']) * speed_amplitude + speed_midpoint)
-            brightness = int(np.sin(time.time() * light['frequency']) * brightness_amplitude + brightness_midpoint)
-        elif light['function'] == 'square':
-            speed = int(np.sign(np.sin(time.time() * light['frequency'])) * speed_amplitude + speed_midpoint)
-            brightness = int(np.sign(np.sin(time.time() * light['frequency'])) * brightness_amplitude + brightness_midpoint)
-        elif light['function'] == 'triangle':
-            speed = int(np.abs(np.sin(time.time() * light['frequency'])) * speed_amplitude + speed_midpoint)
-            brightness = int(np.abs(np.sin(time.time() * light['frequency'])) * brightness_amplitude + brightness_midpoint)
-        elif light['function'] == 'sawtooth_forward':
-            speed = int((time.time() * light['frequency'] % 1) * speed_amplitude + speed_midpoint)
-            brightness = int((time.time() * light['frequency'] % 1) * brightness_amplitude + brightness_midpoint)
-        elif light['function'] == 'sawtooth_backward':
-            speed = int((1 - time.time() * light['frequency'] % 1) * speed_amplitude + speed_midpoint)
-            brightness = int((1 - time.time() * light['frequency'] % 1) * brightness_amplitude + brightness_midpoint)
-        return [speed, brightness]
+    level = time_level(light, now)
+    speed, brightness = light.get('speed'), light.get('brightness')
+    if light['target'] in ('speed', 'both'):
+        low, high = light['speed_range']
+        speed = int(low + (high - low) * level)
+    if light['target'] in ('brightness', 'both'):
+        low, high = light['brightness_range']
+        brightness = int(low + (high - low) * level)
+    return [speed, brightness]
 
 if __name__ == '__main__':
     # Test the functions
     print('fft vec:')
-    fft_vec = np.random.rand(BLOCKSIZE)
+    fft_vec = np.random.rand(WINDOW_LENGTH // 2 + 1)
     print(fft_vec)
     print('fft to dimmer:')
     print(fft_to_dimmer(fft_vec, [0, 2000]))
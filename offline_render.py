@@ -0,0 +1,152 @@
+"""
+offline_render.py
+
+Description: Runs the full light pipeline (AudioListener FFT -> scene plan -> DMX universe) over a WAV file as fast as
+the CPU allows, with no sound card or DMX device. The rendered DMX frames are written to a memory-mapped .npy file
+together with the audio time of each frame, and the frames/sec of each scene are reported, so this doubles as a
+throughput benchmark and a way to preview scenes for a whole track.
+
+Usage: python offline_render.py audio/Oculizer.wav --scene hell --profile testing --out hell.npy
+"""
+
+import argparse
+import time
+import wave
+import numpy as np
+import palette
+from config import audio_parameters
+from audio_listener import AudioListener
+from scene_manager import SceneManager
+from control import load_profile, channel_layout, universe_configs, UNIVERSE_SIZE
+
+SAMPLERATE = audio_parameters['SAMPLERATE']
+BLOCKSIZE = audio_parameters['BLOCKSIZE']
+HOP_SIZE = audio_parameters['HOP_SIZE']
+
+def frame_dtype(n_universes=1):
+    """
+    One record per rendered frame: the audio time of the block in seconds and the universes that were sent for it,
+    end to end.
+    """
+    return np.dtype([('time', np.float64), ('dmx', np.uint8, (n_universes * UNIVERSE_SIZE,))])
+
+FRAME_DTYPE = frame_dtype()
+
+def load_wav(path, sample_rate=SAMPLERATE):
+    """
+    Reads a PCM WAV file into a mono float32 array at the given sample rate.
+
+    Parameters:
+    path (str): The path of the WAV file.
+    sample_rate (int): The sample rate to resample to.
+
+    Returns:
+    np.array: The mono samples, scaled to [-1, 1].
+    """
+    with wave.open(path, 'rb') as f:
+        n_channels = f.getnchannels()
+        sample_width = f.getsampwidth()
+        file_rate = f.getframerate()
+        # read to the end of the file rather than trusting nframes, which some recorders leave unset
+        raw = b''.join(iter(lambda: f.readframes(65536), b''))
+
+    if sample_width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif sample_width == 2:
+        samples = np.frombuffer(raw, dtype='<i2').astype(np.float32) / 2**15
+    elif sample_width == 4:
+        samples = np.frombuffer(raw, dtype='<i4').astype(np.float32) / 2**31
+    else:
+        raise ValueError(f"Unsupported WAV sample width: {sample_width} bytes")
+    samples = samples[:len(samples) // n_channels * n_channels].reshape(-1, n_channels).sum(axis=1)
+
+    if file_rate != sample_rate:
+        from math import gcd
+        from scipy.signal import resample_poly
+        factor = gcd(file_rate, sample_rate)
+        samples = resample_poly(samples, sample_rate // factor, file_rate // factor).astype(np.float32)
+    return samples
+
+def render(samples, scene_name, profile_name='testing', out=None, scenes_directory='scenes', sample_rate=SAMPLERATE,
+           block_size=BLOCKSIZE, seed=None):
+    """
+    Renders the DMX frames a scene produces for an audio signal.
+
+    Parameters:
+    samples (np.array): Mono audio at sample_rate.
+    scene_name (str): The scene to render.
+    profile_name (str): The lighting profile the scene is laid out on.
+    out (str): Optional path of a .npy file to write the frames to as a memory map.
+    scenes_directory (str): Where the scenes are loaded from.
+    seed (int): Seeds the random colors and values, so the same seed renders the same frames.
+
+    Returns:
+    tuple: (frames, seconds) where frames is a frame_dtype array with one record per STFT frame and seconds is the
+        wall-clock time spent rendering.
+    """
+    if seed is not None:
+        palette.seed(seed)
+    audio_listener = AudioListener(sample_rate=sample_rate, block_size=block_size)
+    audio_listener.latency = None  # timestamps are audio time here, not the wall clock
+    scene_manager = SceneManager(scenes_directory)
+    profile = load_profile(profile_name)
+    dtype = frame_dtype(len(universe_configs(profile)))
+    scene_manager.bind_layout(channel_layout(profile))
+    scene_manager.set_scene(scene_name)
+    plan = scene_manager.current_plan
+
+    n_blocks = len(samples) // block_size
+    n_frames = n_blocks * block_size // audio_listener.stft.hop_size
+    if out is not None:
+        frames = np.lib.format.open_memmap(out, mode='w+', dtype=dtype, shape=(n_frames,))
+    else:
+        frames = np.zeros(n_frames, dtype=dtype)
+    blocks = samples[:n_blocks * block_size].reshape(n_blocks, block_size)
+    universe = np.zeros(dtype['dmx'].shape, dtype=np.uint8)
+    fft_data = np.zeros(audio_listener.stft.n_bins, dtype=np.float32)
+
+    start = time.perf_counter()
+    i = 0
+    for b, block in enumerate(blocks):
+        # same path as the live callback, but stamped with the audio time instead of the wall clock
+        audio_listener.audio_buffer.write(block, b * block_size / sample_rate)
+        audio_listener.process_pending()
+        while True:
+            frame = audio_listener.fft_buffer.read_next(out=fft_data)
+            if frame is None:
+                break
+            plan.render(fft_data, universe, audio_listener.tempo.beats(frame[2]), frame[2])
+            frames[i]['time'] = frame[2]
+            frames[i]['dmx'] = universe
+            i += 1
+    seconds = time.perf_counter() - start
+
+    if out is not None:
+        frames.flush()
+    return frames, seconds
+
+def main():
+    parser = argparse.ArgumentParser(description='Render the DMX output of scenes for a WAV file, faster than real time')
+    parser.add_argument('wav', help='WAV file to render')
+    parser.add_argument('-s', '--scene', action='append', help='Scene to render (default: every scene)')
+    parser.add_argument('-p', '--profile', default='testing', help='Lighting profile')
+    parser.add_argument('-o', '--out', help='Output .npy file for one scene, or a file prefix when rendering several')
+    parser.add_argument('--seed', type=int, help='Seed for the random colors, for reproducible renders')
+    args = parser.parse_args()
+
+    samples = load_wav(args.wav)
+    scene_names = args.scene or list(SceneManager('scenes').scenes.keys())
+    duration = len(samples) / SAMPLERATE
+    print(f"{args.wav}: {duration:.1f} s of audio, {len(samples) // HOP_SIZE} frames every {HOP_SIZE} samples")
+
+    for scene_name in scene_names:
+        out = None
+        if args.out is not None:
+            out = args.out if len(scene_names) == 1 else f"{args.out}_{scene_name}.npy"
+        frames, seconds = render(samples, scene_name, args.profile, out, seed=args.seed)
+        fps = len(frames) / seconds if seconds > 0 else float('inf')
+        print(f"{scene_name}: {len(frames)} frames in {seconds * 1000:.1f} ms "
+              f"({fps:.0f} frames/sec, {duration / seconds if seconds > 0 else float('inf'):.0f}x real time)")
+
+if __name__ == '__main__':
+    main()
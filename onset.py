@@ -0,0 +1,82 @@
+"""
+Provides the OnsetDetector class, a streaming onset detector over consecutive FFT frames. For each band it computes
+the half-wave-rectified spectral flux (how much the log magnitude rose since the previous frame) and compares it with
+an adaptive threshold kept as an exponential moving mean and mean deviation, so the state per band is a few numbers
+and each frame is O(bins + bands).
+"""
+
+import numpy as np
+from config import audio_parameters
+from mapping import BandEnergy
+
+SAMPLERATE = audio_parameters['SAMPLERATE']
+HOP_SIZE = audio_parameters['HOP_SIZE']
+WINDOW_LENGTH = audio_parameters['WINDOW_LENGTH']
+FRAME_SECONDS = HOP_SIZE / SAMPLERATE  # time between consecutive FFT frames
+
+class OnsetDetector:
+    def __init__(self, bands, sensitivity=1.5, adaptation=0.5, min_interval=0.1, floor=0.01,
+                 n_bins=WINDOW_LENGTH // 2 + 1, frame_seconds=FRAME_SECONDS):
+        """
+        Parameters:
+        bands (list): The bands to detect onsets in, as accepted by BandEnergy (frequency ranges or bin weights).
+        sensitivity (float or list): How many mean deviations above the running mean the flux has to be to count
+            as an onset. Lower is more sensitive. Can be given per band.
+        adaptation (float): Time constant of the running mean and deviation in seconds.
+        min_interval (float): Minimum time between two onsets in the same band in seconds.
+        floor (float): Flux below this never counts as an onset, so silence doesn't trigger on noise.
+        """
+        self.band_energy = BandEnergy(bands, n_bins)
+        n_bands = len(bands)
+        self.n_bins = n_bins
+        self.sensitivity = np.broadcast_to(np.asarray(sensitivity, dtype=np.float32), (n_bands,)).copy()
+        self.alpha = np.float32(1.0 - np.exp(-frame_seconds / adaptation))
+        self.min_frames = max(1, int(round(min_interval / frame_seconds)))
+        self.warmup_frames = int(round(adaptation / frame_seconds))
+        self.floor = np.float32(floor)
+        self.mean = np.zeros(n_bands, dtype=np.float32)
+        self.deviation = np.zeros(n_bands, dtype=np.float32)
+        self.threshold = np.zeros(n_bands, dtype=np.float32)
+        self.onsets = np.zeros(n_bands, dtype=bool)
+        self.frames_since_onset = np.full(n_bands, self.min_frames, dtype=np.int64)
+        self.flux = None
+        self._log = np.zeros(n_bins, dtype=np.float32)
+        self._previous = np.zeros(n_bins, dtype=np.float32)
+        self._rise = np.zeros(n_bins, dtype=np.float32)
+        self._error = np.zeros(n_bands, dtype=np.float32)
+        self._frames_seen = 0
+
+    def process(self, magnitude):
+        """
+        Updates the detector with the next FFT magnitude frame.
+
+        Returns:
+        np.array: Whether each band had an onset in this frame. The array is reused by the next call.
+        """
+        np.log1p(magnitude[:self.n_bins], out=self._log)
+        np.subtract(self._log, self._previous, out=self._rise)
+        np.maximum(self._rise, 0, out=self._rise)
+        self._log, self._previous = self._previous, self._log
+        self.flux = self.band_energy(self._rise)
+        self._frames_seen += 1
+        if self._frames_seen == 1:
+            # the first frame has nothing to compare with
+            self.onsets[:] = False
+            return self.onsets
+
+        np.multiply(self.deviation, self.sensitivity, out=self.threshold)
+        self.threshold += self.mean
+        np.maximum(self.threshold, self.floor, out=self.threshold)
+        np.greater(self.flux, self.threshold, out=self.onsets)
+        self.onsets &= self.frames_since_onset >= self.min_frames
+        if self._frames_seen <= self.warmup_frames:
+            # let the running statistics settle before trusting them
+            self.onsets[:] = False
+
+        np.subtract(self.flux, self.mean, out=self._error)
+        self.mean += self.alpha * self._error
+        np.abs(self._error, out=self._error)
+        self.deviation += self.alpha * (self._error - self.deviation)
+        self.frames_since_onset += 1
+        self.frames_since_onset[self.onsets] = 0
+        return self.onsets
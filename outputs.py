@@ -0,0 +1,341 @@
+"""
+Provides the DMX outputs that universe frames are sent to, and the UniverseWriter thread that sends one universe's
+frames to its output.
+
+An output is an OutputBackend registered by name in OUTPUTS (see register_output): "opendmx", "artnet", "sacn",
+"null", which drops frames and is meant for throughput measurements without hardware, and "recording", which appends
+every frame with its timestamp to a file (see read_recording). A profile declares its universes in a "universes" list,
+one entry per universe giving its output and the output's options, e.g. {"output": "opendmx", "serial": "A6XGYHGC"};
+a profile without one has a single OpenDMX universe. Each
+universe gets its own writer thread, so the light thread only hands frames over and a slow or blocked interface
+doesn't hold up the others.
+
+The network outputs send whole universes over UDP: Art-Net ("artnet", ArtDmx packets to port 6454) and sACN
+("sacn", E1.31 data packets to port 5568, multicast by default). Each keeps one socket and one preallocated packet
+whose header is written once, so a frame costs a copy into the packet, a sequence number and a send. Network nodes
+expect frames to keep coming, so their writers resend the last frame every 1 / refresh_rate seconds while nothing
+changes. dmx_receiver.py receives both on localhost for testing without hardware.
+"""
+
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+import numpy as np
+
+UNIVERSE_SIZE = 512
+ARTNET_PORT = 6454
+SACN_PORT = 5568
+ARTNET_HEADER_SIZE = 18
+SACN_HEADER_SIZE = 126
+DEFAULT_REFRESH_RATE = 44.0  # frames per second, the most a full DMX universe carries
+# one record of a recording: the wall-clock time the frame was sent and the frame
+RECORD_DTYPE = np.dtype([('time', np.float64), ('dmx', np.uint8, (UNIVERSE_SIZE,))])
+
+class OutputBackend:
+    """
+    Where the frames of one universe go. Subclasses implement send(); UniverseWriter calls it from its own thread with
+    a (UNIVERSE_SIZE,) uint8 array it won't change afterwards, and calls close() when it stops. A backend with a
+    refresh_interval (seconds) gets the last frame again whenever that long passes without a new one.
+    """
+    refresh_interval = None
+
+    def send(self, frame):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+_universe_controller_class = None
+
+def universe_controller_class():
+    """
+    Returns the UniverseDMXController class, importing PyDMXControl (and the web server it pulls in) on first use,
+    so starting up without opening a DMX interface doesn't pay for the import.
+    """
+    global _universe_controller_class
+    if _universe_controller_class is None:
+        from PyDMXControl.controllers import OpenDMXController
+
+        class UniverseDMXController(OpenDMXController):
+            """
+            OpenDMXController that transmits a whole universe frame assembled by the LightController, instead of
+            building the frame from PyDMXControl fixtures on every tick.
+            """
+            def __init__(self, *args, **kwargs):
+                self.frame = [0] * UNIVERSE_SIZE
+                super().__init__(*args, **kwargs)
+
+            def get_frame(self):
+                return self.frame
+
+        _universe_controller_class = UniverseDMXController
+    return _universe_controller_class
+
+class OpenDMXOutput(OutputBackend):
+    """
+    An Enttec OpenDMX (FTDI) USB interface. PyDMXControl retransmits the last frame on its own thread.
+    """
+    def __init__(self, serial=None):
+        """
+        Parameters:
+        serial (str): The FTDI serial number of the interface, needed when more than one is plugged in.
+        """
+        self.controller = universe_controller_class()(ftdi_serial=serial)
+
+    def send(self, frame):
+        # a single reference swap, so the transmit thread never sees a half-written frame
+        self.controller.frame = frame.tolist()
+
+    def close(self):
+        self.controller.close()
+
+def artnet_header(universe, length=UNIVERSE_SIZE):
+    """
+    Returns the header of an ArtDmx packet for a 15-bit port address (net, sub-net and universe), with the sequence
+    number (byte 12) left at 0.
+    """
+    if not 0 <= universe < 1 << 15:
+        raise ValueError(f"Art-Net universe {universe} is out of range (0 to 32767)")
+    header = bytearray(b'Art-Net\x00')
+    header += (0x5000).to_bytes(2, 'little')  # OpDmx
+    header += (14).to_bytes(2, 'big')  # protocol version
+    header += bytes([0, 0, universe & 0xFF, universe >> 8])  # sequence, physical, sub-net/universe, net
+    header += length.to_bytes(2, 'big')
+    return header
+
+def sacn_header(universe, cid, source_name='PlaylistPulser', priority=100, length=UNIVERSE_SIZE):
+    """
+    Returns the root, framing and DMP layers of an E1.31 data packet, with the sequence number (byte 111) left at 0.
+    """
+    if not 1 <= universe <= 63999:
+        raise ValueError(f"sACN universe {universe} is out of range (1 to 63999)")
+    total = SACN_HEADER_SIZE + length
+
+    def flags_and_length(offset):
+        return (0x7000 | (total - offset)).to_bytes(2, 'big')
+
+    header = bytearray()
+    header += (0x0010).to_bytes(2, 'big') + (0).to_bytes(2, 'big')  # preamble and postamble size
+    header += b'ASC-E1.17\x00\x00\x00'
+    header += flags_and_length(16) + (0x00000004).to_bytes(4, 'big') + cid
+    header += flags_and_length(38) + (0x00000002).to_bytes(4, 'big')
+    header += source_name.encode('utf-8')[:63].ljust(64, b'\x00')
+    header += bytes([priority]) + (0).to_bytes(2, 'big')  # priority, sync address
+    header += bytes([0, 0]) + universe.to_bytes(2, 'big')  # sequence, options, universe
+    header += flags_and_length(115) + bytes([0x02, 0xA1])
+    header += (0).to_bytes(2, 'big') + (1).to_bytes(2, 'big') + (length + 1).to_bytes(2, 'big')
+    header += bytes([0])  # DMX start code
+    return header
+
+class NetworkOutput(OutputBackend):
+    """
+    Sends universes as UDP packets built in one preallocated buffer. Subclasses write the header and say where the
+    sequence number goes.
+    """
+    sequence_offset = None
+
+    def __init__(self, header, host, port, refresh_rate=DEFAULT_REFRESH_RATE, broadcast=False):
+        self.packet = bytearray(header) + bytearray(UNIVERSE_SIZE)
+        self.data = memoryview(self.packet)[len(header):]
+        self.sequence = 0
+        self.refresh_interval = 1.0 / refresh_rate if refresh_rate else None
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if broadcast:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        self.socket.connect((host, port))
+        self.packets_sent = 0
+
+    def next_sequence(self):
+        self.sequence = (self.sequence + 1) & 0xFF
+        return self.sequence
+
+    def send(self, frame):
+        self.data[:] = frame
+        self.packet[self.sequence_offset] = self.next_sequence()
+        self.socket.send(self.packet)
+        self.packets_sent += 1
+
+    def close(self):
+        self.socket.close()
+
+class ArtNetOutput(NetworkOutput):
+    """
+    An Art-Net node. Sequence numbers run from 1 to 255; 0 would tell the node not to reorder.
+    """
+    sequence_offset = 12
+
+    def __init__(self, host='255.255.255.255', universe=0, port=ARTNET_PORT, refresh_rate=DEFAULT_REFRESH_RATE):
+        """
+        Parameters:
+        host (str): The node's address, or a broadcast address.
+        universe (int): The 15-bit port address the node listens on.
+        port (int): The UDP port.
+        refresh_rate (float): Frames per second to resend the last frame at when nothing changes, 0 to not resend.
+        """
+        super().__init__(artnet_header(universe), host, port, refresh_rate, broadcast=host.endswith('.255'))
+
+    def next_sequence(self):
+        self.sequence = self.sequence % 255 + 1
+        return self.sequence
+
+class SACNOutput(NetworkOutput):
+    """
+    An sACN (E1.31) receiver, by default through the universe's multicast group.
+    """
+    sequence_offset = 111
+
+    def __init__(self, host=None, universe=1, port=SACN_PORT, refresh_rate=DEFAULT_REFRESH_RATE, priority=100,
+                 source_name='PlaylistPulser', cid=None):
+        """
+        Parameters:
+        host (str): The receiver's address. Defaults to the universe's multicast group, 239.255.<hi>.<lo>.
+        universe (int): The sACN universe, from 1 to 63999.
+        port (int): The UDP port.
+        refresh_rate (float): Frames per second to resend the last frame at when nothing changes, 0 to not resend.
+        priority (int): The source priority, from 0 to 200.
+        source_name (str): The name receivers show for this source.
+        cid (str): This source's UUID. A new one is made for every run if not given.
+        """
+        if host is None:
+            host = f'239.255.{universe >> 8}.{universe & 0xFF}'
+        cid = uuid.UUID(cid).bytes if cid is not None else uuid.uuid4().bytes
+        super().__init__(sacn_header(universe, cid, source_name, priority), host, port, refresh_rate)
+
+class NullOutput(OutputBackend):
+    """
+    Drops every frame, for measuring the pipeline without any output cost.
+    """
+    def __init__(self):
+        self.frames_sent = 0
+
+    def send(self, frame):
+        self.frames_sent += 1
+
+class RecordingOutput(OutputBackend):
+    """
+    Appends every frame, with the wall-clock time it was sent, to a file of RECORD_DTYPE records.
+    """
+    def __init__(self, path):
+        """
+        Parameters:
+        path (str): The file to append to. It is created, along with its directory, if it doesn't exist.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, 'ab')
+        self.record = np.zeros(1, dtype=RECORD_DTYPE)
+        self.frames_sent = 0
+
+    def send(self, frame):
+        self.record['time'] = time.time()
+        self.record['dmx'] = frame
+        self.file.write(self.record)
+        self.frames_sent += 1
+
+    def close(self):
+        self.file.close()
+
+def read_recording(path):
+    """
+    Returns the frames of a recording as a RECORD_DTYPE array.
+    """
+    return np.fromfile(path, dtype=RECORD_DTYPE)
+
+OUTPUTS = {
+    'opendmx': OpenDMXOutput,
+    'artnet': ArtNetOutput,
+    'sacn': SACNOutput,
+    'null': NullOutput,
+    'recording': RecordingOutput,
+}
+
+def register_output(name, backend):
+    """
+    Makes an OutputBackend subclass available to profiles as {"output": name, ...}.
+    """
+    if not (isinstance(backend, type) and issubclass(backend, OutputBackend)):
+        raise ValueError(f"Output '{name}' has to be an OutputBackend subclass")
+    OUTPUTS[name] = backend
+
+def open_output(config):
+    """
+    Opens the output of one universe entry of a profile.
+
+    Parameters:
+    config (dict): The universe's "output" (default 'opendmx') and the keyword arguments of that output.
+    """
+    options = dict(config)
+    name = options.pop('output', 'opendmx')
+    if name not in OUTPUTS:
+        raise ValueError(f"Output '{name}' not found. Options are: {', '.join(OUTPUTS)}")
+    return OUTPUTS[name](**options)
+
+class UniverseWriter(threading.Thread):
+    """
+    Sends the frames of one universe to its output. write() only stores the frame and wakes the thread; if frames
+    come faster than the output takes them, the writer skips to the newest one. If the output has a refresh_interval,
+    the last frame is resent whenever that long passes without a new one.
+    """
+    def __init__(self, output, index=0, error_queue=None, latency=None):
+        """
+        Parameters:
+        output (OutputBackend): The universe's output.
+        index (int): The universe's position in the profile, for error messages.
+        error_queue (queue.Queue): Where send errors are reported.
+        latency (LatencyTracker): Where the 'flush' stage is recorded once a frame written with an ADC time has been
+            sent.
+        """
+        threading.Thread.__init__(self, daemon=True)
+        self.output = output
+        self.index = index
+        self.error_queue = error_queue if error_queue is not None else queue.Queue()
+        self.latency = latency
+        self.latest = None  # (frame, adc_time), swapped as a whole by write()
+        self.pending = threading.Event()
+        self.stopped = threading.Event()
+        self.frames_written = 0
+
+    def write(self, frame, adc_time=None):
+        """
+        Queues a frame for sending. The writer keeps the array, so pass one that won't be written to again.
+
+        Parameters:
+        frame (np.array): The (UNIVERSE_SIZE,) uint8 frame.
+        adc_time (float): The time.monotonic() ADC timestamp of the audio the frame was rendered from, if any.
+        """
+        self.latest = (frame, adc_time)
+        self.pending.set()
+
+    def run(self):
+        refresh_interval = self.output.refresh_interval
+        recorded = None  # the last write whose latency was recorded, so refreshes don't count again
+        while True:
+            if not self.pending.wait(refresh_interval) and self.latest is None:
+                continue  # nothing to resend yet
+            if self.stopped.is_set():
+                break
+            self.pending.clear()
+            latest = self.latest
+            frame, adc_time = latest
+            try:
+                self.output.send(frame)
+                self.frames_written += 1
+            except Exception as e:
+                self.error_queue.put(f"Error writing universe {self.index}: {str(e)}")
+                continue
+            if self.latency is not None and adc_time is not None and latest is not recorded:
+                self.latency.record('flush', adc_time)
+                recorded = latest
+        try:
+            self.output.close()
+        except Exception as e:
+            self.error_queue.put(f"Error closing universe {self.index}: {str(e)}")
+
+    def stop(self):
+        self.stopped.set()
+        self.pending.set()
@@ -0,0 +1,154 @@
+"""
+Provides the color palette as an indexed (N, 3) uint8 array, a precomputed HSV fade table for smooth color fades, and
+a seeded stream of random colors and DMX values.
+
+Random draws come from one NumPy Generator in blocks of BLOCK_SIZE, so picking colors for any number of fixtures is
+one slice of a pre-drawn array, and seeding the stream (see seed) makes a run reproducible.
+"""
+
+import numpy as np
+
+# these are DMX colors
+colors = {
+    'red': [255, 0, 0],
+    'orange': [255, 127, 0],
+    'yellow': [255, 255, 0],
+    'green': [0, 255, 0],
+    'blue': [0, 0, 255],
+    'purple': [75, 0, 130],
+    'pink': [255, 0, 255],
+    'white': [255, 255, 255]
+}
+
+COLOR_NAMES = tuple(colors)
+PALETTE = np.array([colors[name] for name in COLOR_NAMES], dtype=np.uint8)
+COLOR_INDEX = {name: i for i, name in enumerate(COLOR_NAMES)}
+FADE_STEPS = 64  # fade table entries between two neighbouring palette colors
+BLOCK_SIZE = 4096
+
+def color_index(name):
+    if name not in COLOR_INDEX:
+        raise ValueError(f"Color '{name}' not found. Options are: {', '.join(COLOR_NAMES)}")
+    return COLOR_INDEX[name]
+
+def rgb_to_hsv(rgb):
+    """
+    Converts an (..., 3) array of 0-255 RGB values to hue, saturation and value, each between 0 and 1.
+    """
+    rgb = np.asarray(rgb, dtype=np.float64) / 255.0
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    value = rgb.max(axis=-1)
+    chroma = value - rgb.min(axis=-1)
+    safe_chroma = np.where(chroma > 0, chroma, 1.0)
+    hue = np.where(value == r, (g - b) / safe_chroma,
+                   np.where(value == g, 2.0 + (b - r) / safe_chroma, 4.0 + (r - g) / safe_chroma))
+    hue = np.where(chroma > 0, (hue / 6.0) % 1.0, 0.0)
+    saturation = np.where(value > 0, chroma / np.where(value > 0, value, 1.0), 0.0)
+    return np.stack([hue, saturation, value], axis=-1)
+
+def hsv_to_rgb(hsv):
+    """
+    Converts an (..., 3) array of hue, saturation and value (0 to 1) to 0-255 RGB values.
+    """
+    hsv = np.asarray(hsv, dtype=np.float64)
+    hue, saturation, value = hsv[..., 0] % 1.0, hsv[..., 1], hsv[..., 2]
+    sector = hue * 6.0
+    k = (np.array([5.0, 3.0, 1.0]) + sector[..., None]) % 6.0
+    rgb = value[..., None] - value[..., None] * saturation[..., None] * np.clip(np.minimum(k, 4.0 - k), 0.0, 1.0)
+    return np.round(rgb * 255.0).astype(np.uint8)
+
+def fade_table(palette=PALETTE, steps=FADE_STEPS):
+    """
+    Interpolates from each palette color to the next (wrapping back to the first) in HSV, along the shorter way
+    around the hue circle, so a fade passes through saturated colors instead of the greys a straight RGB blend gives.
+
+    Returns:
+    np.array: A (len(palette) * steps, 3) uint8 table; entry i * steps is palette color i.
+    """
+    start = rgb_to_hsv(palette)
+    end = np.roll(start, -1, axis=0)
+    # greys have no hue, so they take their neighbour's and only fade in saturation and value
+    start_hue = np.where(start[:, 1] > 0, start[:, 0], end[:, 0])
+    end_hue = np.where(end[:, 1] > 0, end[:, 0], start_hue)
+    hue_step = (end_hue - start_hue + 0.5) % 1.0 - 0.5
+    t = np.arange(steps)[None, :] / steps
+    hsv = np.stack([start_hue[:, None] + hue_step[:, None] * t,
+                    start[:, 1, None] + (end[:, 1] - start[:, 1])[:, None] * t,
+                    start[:, 2, None] + (end[:, 2] - start[:, 2])[:, None] * t], axis=-1)
+    return hsv_to_rgb(hsv.reshape(-1, 3))
+
+FADE_TABLE = fade_table()
+MAX_FADE_RATE = 2.0  # palette colors per second at a colorfade of 255
+
+def fade_rate(colorfade):
+    """
+    Returns how many palette colors per second a light with the given colorfade (0-255) moves through.
+    """
+    return colorfade / 255.0 * MAX_FADE_RATE
+
+def fade_color(position):
+    """
+    Returns the fade color at a position counted in palette colors (so 2.5 is halfway from color 2 to color 3).
+    Works on arrays of positions too.
+    """
+    index = (np.asarray(position) * FADE_STEPS).astype(np.intp) % len(FADE_TABLE)
+    return FADE_TABLE[index]
+
+class RandomStream:
+    """
+    Random palette indices and DMX values served from blocks drawn by one seeded Generator.
+    """
+    def __init__(self, seed=None, n_colors=len(PALETTE), block_size=BLOCK_SIZE):
+        self.n_colors = n_colors
+        self.block_size = block_size
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        self.generator = np.random.default_rng(seed)
+        self._indices = self._values = None
+        self._index_position = self._value_position = self.block_size
+
+    def _take(self, n, block, position, draw):
+        if n > self.block_size:
+            return draw(n), block, position
+        if position + n > self.block_size:
+            block, position = draw(self.block_size), 0
+        return block[position:position + n], block, position + n
+
+    def indices(self, n):
+        """
+        Returns n random palette indices. The array is a view into the current block, so use it before the next call.
+        """
+        out, self._indices, self._index_position = self._take(
+            n, self._indices, self._index_position,
+            lambda size: self.generator.integers(0, self.n_colors, size, dtype=np.intp))
+        return out
+
+    def values(self, n):
+        """
+        Returns n random DMX values between 0 and 254, as a view into the current block.
+        """
+        out, self._values, self._value_position = self._take(
+            n, self._values, self._value_position,
+            lambda size: self.generator.integers(0, 255, size, dtype=np.uint8))
+        return out
+
+_stream = RandomStream()
+
+def seed(value=None):
+    """
+    Reseeds the shared random stream, so the random colors and values that follow are reproducible.
+    """
+    _stream.seed(value)
+
+def random_colors(n):
+    """
+    Returns an (n, 3) uint8 array of random palette colors.
+    """
+    return PALETTE[_stream.indices(n)]
+
+def random_values(n):
+    return _stream.values(n)
+
+def random_color_name():
+    return COLOR_NAMES[_stream.indices(1)[0]]
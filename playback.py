@@ -0,0 +1,133 @@
+"""
+Provides the PlaybackService thread, the one place that asks Spotify what is playing, and publishes a track change
+event whenever the track changes.
+
+Instead of polling at a fixed rate, it uses the progress_ms and duration_ms of each reply to predict when the track
+will end and sleeps until lead seconds before that, then polls every boundary_interval seconds until the change shows
+up. Sleeps are capped at max_interval so skips and pauses are still noticed. All requests go through one
+requests.Session, so the connection to the API is kept alive between polls, and api_base can point at a local stub
+server (see playback_stub.py) for testing without an account.
+"""
+
+import queue
+import threading
+import time
+import requests
+
+API_BASE = 'https://api.spotify.com/v1'
+
+def track_event(state, previous_id=None, now=None):
+    """
+    Returns the track change event for a playback state from GET /me/player (None when nothing is playing).
+    """
+    item = (state or {}).get('item') or {}
+    return {
+        'track_id': item.get('id'),
+        'previous_id': previous_id,
+        'name': item.get('name'),
+        'artists': [artist['name'] for artist in item.get('artists', [])],
+        'duration_ms': item.get('duration_ms'),
+        'progress_ms': (state or {}).get('progress_ms'),
+        'is_playing': bool((state or {}).get('is_playing')),
+        'time': time.monotonic() if now is None else now,
+    }
+
+class PlaybackService(threading.Thread):
+    def __init__(self, token, api_base=API_BASE, session=None, lead=1.0, boundary_interval=0.25, max_interval=10.0,
+                 idle_interval=5.0, timeout=5.0):
+        """
+        Parameters:
+        token (str or function): A Spotify access token with the user-read-playback-state scope, or a function that
+            returns a current one (e.g. an auth manager's get_access_token), called before every request.
+        api_base (str): The Web API root, without a trailing slash.
+        session (requests.Session): The session to send requests with. A new one is made if not given.
+        lead (float): Seconds before the predicted end of a track to start polling every boundary_interval.
+        boundary_interval (float): Seconds between polls around a track change.
+        max_interval (float): The longest sleep between polls while a track is playing.
+        idle_interval (float): Seconds between polls while nothing is playing.
+        timeout (float): Seconds to wait for a reply.
+        """
+        threading.Thread.__init__(self, daemon=True)
+        self.token = token
+        self.api_base = api_base.rstrip('/')
+        self.session = session if session is not None else requests.Session()
+        self.lead = lead
+        self.boundary_interval = boundary_interval
+        self.max_interval = max_interval
+        self.idle_interval = idle_interval
+        self.timeout = timeout
+        self.events = queue.Queue()
+        self.error_queue = queue.Queue()
+        self.state = None
+        self.track_id = None
+        self.requests = 0
+        self.stopped = threading.Event()
+
+    def fetch(self):
+        """
+        Returns the current playback state, or None if nothing is playing.
+        """
+        token = self.token() if callable(self.token) else self.token
+        response = self.session.get(f'{self.api_base}/me/player', headers={'Authorization': f'Bearer {token}'},
+                                    timeout=self.timeout)
+        self.requests += 1
+        if response.status_code == 204:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    def next_interval(self, state):
+        """
+        Returns how long to sleep before the next poll after seeing state.
+        """
+        if state is None or not state.get('is_playing') or not state.get('item'):
+            return self.idle_interval
+        remaining = (state['item']['duration_ms'] - state['progress_ms']) / 1000.0
+        if remaining <= self.lead:
+            return self.boundary_interval  # the change is due, watch for it
+        return min(remaining - self.lead, self.max_interval)
+
+    def poll(self):
+        """
+        Fetches the playback state, publishes an event if the track changed and returns the seconds until the next
+        poll.
+        """
+        state = self.fetch()
+        self.state = state
+        track_id = ((state or {}).get('item') or {}).get('id')
+        if track_id != self.track_id:
+            self.events.put(track_event(state, self.track_id))
+            self.track_id = track_id
+        return self.next_interval(state)
+
+    def run(self):
+        interval = 0.0
+        while not self.stopped.wait(interval):
+            try:
+                interval = self.poll()
+            except requests.HTTPError as e:
+                retry_after = e.response.headers.get('Retry-After') if e.response is not None else None
+                self.error_queue.put(f"Error polling playback: {str(e)}")
+                interval = float(retry_after) if retry_after else self.idle_interval
+            except Exception as e:
+                self.error_queue.put(f"Error polling playback: {str(e)}")
+                interval = self.idle_interval
+
+    def get_event(self, timeout=None):
+        """
+        Returns the next track change event, or None if there is none within timeout seconds.
+        """
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def get_errors(self):
+        errors = []
+        while not self.error_queue.empty():
+            errors.append(self.error_queue.get_nowait())
+        return errors
+
+    def stop(self):
+        self.stopped.set()
+        self.session.close()
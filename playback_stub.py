@@ -0,0 +1,126 @@
+"""
+playback_stub.py
+
+Description: A local stand-in for the Spotify Web API's GET /v1/me/player, for testing PlaybackService without an
+account. StubPlayer plays a list of tracks back to back on the wall clock (optionally sped up) and serves the current
+playback state the way the API does, or 204 once the playlist is over. It counts the requests it gets, so the polling
+can be compared with a fixed-rate poller.
+
+Usage:
+    python playback_stub.py          # plays three short tracks and prints the track changes PlaybackService sees
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from playback import PlaybackService
+
+def stub_tracks(durations_ms):
+    return [{'id': f'track{i}', 'name': f'Track {i}', 'duration_ms': int(duration),
+             'artists': [{'id': f'artist{i}', 'name': f'Artist {i}'}]} for i, duration in enumerate(durations_ms)]
+
+class StubPlayer:
+    def __init__(self, tracks, host='127.0.0.1', port=0, speed=1.0):
+        """
+        Parameters:
+        tracks (list): The track objects to play, each with at least an id and a duration_ms (see stub_tracks).
+        host (str): The address to serve on.
+        port (int): The port, 0 for a free one.
+        speed (float): How many times faster than real time the playlist plays.
+        """
+        self.tracks = tracks
+        self.speed = speed
+        self.requests = 0
+        self.started_at = time.monotonic()
+        self.ends = []
+        end = 0
+        for track in tracks:
+            end += track['duration_ms']
+            self.ends.append(end)
+        player = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+
+            def do_GET(self):
+                player.requests += 1
+                if self.path.rstrip('/') != '/v1/me/player':
+                    self.reply(404, {'error': {'status': 404, 'message': 'Not found'}})
+                    return
+                state = player.state()
+                if state is None:
+                    self.reply(204)
+                else:
+                    self.reply(200, state)
+
+            def reply(self, status, body=None):
+                data = json.dumps(body).encode() if body is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.api_base = f'http://{host}:{self.server.server_address[1]}/v1'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def position_ms(self):
+        return (time.monotonic() - self.started_at) * 1000.0 * self.speed
+
+    def state(self):
+        """
+        Returns the playback state at this moment, or None after the last track.
+        """
+        position = self.position_ms()
+        start = 0
+        for track, end in zip(self.tracks, self.ends):
+            if position < end:
+                return {'is_playing': True, 'progress_ms': int(position - start), 'item': track,
+                        'timestamp': int(time.time() * 1000)}
+            start = end
+        return None
+
+    def change_times(self):
+        """
+        Returns the time.monotonic() at which each track after the first starts.
+        """
+        return [self.started_at + end / 1000.0 / self.speed for end in self.ends[:-1]]
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def main():
+    player = StubPlayer(stub_tracks([3000, 2000, 4000]))
+    player.start()
+    service = PlaybackService('stub-token', api_base=player.api_base)
+    service.start()
+    changes = iter(player.change_times())
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        event = service.get_event(timeout=0.1)
+        if event is None:
+            continue
+        if event['track_id'] is None:
+            print(f"Playback ended ({service.requests} requests)")
+            break
+        late = ''
+        if event['previous_id'] is not None:
+            late = f", {(event['time'] - next(changes)) * 1000:.0f} ms after the change"
+        print(f"Now playing {event['name']} by {', '.join(event['artists'])}{late} ({service.requests} requests)")
+    for error in service.get_errors():
+        print(f"Error: {error}")
+    service.stop()
+    player.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Provides the FrameRingBuffer class, a preallocated NumPy ring buffer used to hand fixed-size frames (audio blocks,
+FFT vectors) from a producer thread to a consumer thread without locks or unbounded queues.
+
+There is a single writer and a single "next unseen" reader. Every frame gets a sequence number; the writer invalidates
+a slot's sequence number before copying into it and republishes it afterwards, so a reader that races the writer can
+detect the torn copy and retry instead of returning garbage.
+"""
+
+import numpy as np
+
+class FrameRingBuffer:
+    def __init__(self, capacity, frame_shape, dtype=np.float32):
+        """
+        Parameters:
+        capacity (int): The number of frames kept before the oldest one is overwritten.
+        frame_shape (int or tuple): The shape of a single frame.
+        dtype (np.dtype): The dtype of the stored frames.
+        """
+        if capacity < 2:
+            raise ValueError(f"Ring buffer capacity must be at least 2, got {capacity}")
+        if isinstance(frame_shape, int):
+            frame_shape = (frame_shape,)
+        self.capacity = capacity
+        self.frame_shape = tuple(frame_shape)
+        self.frames = np.zeros((capacity,) + self.frame_shape, dtype=dtype)
+        self.seqs = np.full(capacity, -1, dtype=np.int64)
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.write_seq = 0  # sequence number of the next frame to be written
+        self.read_seq = 0  # sequence number of the next frame the reader has not seen
+        self.overwrites = 0  # frames overwritten before the reader got to them
+        self.drops = 0  # frames the reader had to skip because they were overwritten
+
+    def write(self, data, timestamp=0.0):
+        """
+        Copies a frame into the next slot. Only ever called from the producer thread.
+
+        Parameters:
+        data (np.array): The frame to store. Must broadcast to frame_shape.
+        timestamp (float): The capture time of the frame.
+
+        Returns:
+        int: The sequence number assigned to the frame.
+        """
+        seq = self.write_seq
+        idx = seq % self.capacity
+        if self.seqs[idx] >= self.read_seq:
+            self.overwrites += 1
+        self.seqs[idx] = -1
+        self.frames[idx] = data
+        self.timestamps[idx] = timestamp
+        self.seqs[idx] = seq
+        self.write_seq = seq + 1
+        return seq
+
+    def _copy(self, seq, out):
+        idx = seq % self.capacity
+        timestamp = self.timestamps[idx]
+        if out is None:
+            out = self.frames[idx].copy()
+        else:
+            out[...] = self.frames[idx]
+        # the slot was reused while we were copying it
+        if self.seqs[idx] != seq or self.timestamps[idx] != timestamp:
+            return None
+        return out, timestamp
+
+    def has_unseen(self):
+        return self.read_seq < self.write_seq
+
+    def unseen_count(self):
+        return self.write_seq - self.read_seq
+
+    def read_latest(self, out=None, consume=False):
+        """
+        Returns the newest frame.
+
+        Parameters:
+        out (np.array): Optional preallocated array to copy into.
+        consume (bool): Whether to advance the reader past the returned frame. Unseen frames older than it are
+            counted as drops.
+
+        Returns:
+        tuple: (seq, frame, timestamp), or None if nothing has been written yet.
+        """
+        while True:
+            seq = self.write_seq - 1
+            if seq < 0:
+                return None
+            copied = self._copy(seq, out)
+            if copied is not None:
+                if consume and seq >= self.read_seq:
+                    self.drops += seq - self.read_seq
+                    self.read_seq = seq + 1
+                return seq, copied[0], copied[1]
+
+    def read_next(self, out=None):
+        """
+        Returns the oldest frame the reader has not seen yet and advances the reader past it. If the reader fell
+        more than a full buffer behind, the overwritten frames are skipped and counted as drops.
+
+        Parameters:
+        out (np.array): Optional preallocated array to copy into.
+
+        Returns:
+        tuple: (seq, frame, timestamp), or None if there is no unseen frame.
+        """
+        while True:
+            write_seq = self.write_seq
+            if self.read_seq >= write_seq:
+                return None
+            oldest = write_seq - self.capacity
+            if self.read_seq < oldest:
+                self.drops += oldest - self.read_seq
+                self.read_seq = oldest
+            seq = self.read_seq
+            copied = self._copy(seq, out)
+            if copied is not None:
+                self.read_seq = seq + 1
+                return seq, copied[0], copied[1]
+
+    def stats(self):
+        return {
+            'written': self.write_seq,
+            'unseen': self.unseen_count(),
+            'overwrites': self.overwrites,
+            'drops': self.drops,
+        }
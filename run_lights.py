@@ -0,0 +1,68 @@
+"""
+run_lights.py
+
+Description: Headless entry point for running the lights. Starts the audio listener, the light controller and the scene
+watcher and runs until interrupted, printing any errors. It imports only what the light loop needs (no curses, Spotify
+or analysis libraries), so a restart on a small box doesn't spend seconds importing; benchmark.py --imports checks
+this against IMPORT_BUDGET_SECONDS.
+
+Usage:
+    python run_lights.py --profile testing --scene hell
+"""
+
+import argparse
+import logging
+import time
+from audio_listener import AudioListener
+from scene_manager import SceneManager, SceneWatcher
+from control import LightController, SELF_TEST_MODES
+
+IMPORT_BUDGET_SECONDS = 0.5  # cold `import run_lights`, measured in a fresh interpreter
+# modules the light loop must not import at startup; PyDMXControl is only imported once a controller is opened
+HEAVY_MODULES = ('scipy', 'curses', 'pandas', 'sklearn', 'matplotlib', 'plotly', 'ipywidgets', 'savify', 'spotipy',
+                 'PyDMXControl')
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the lights without the terminal interface')
+    parser.add_argument('--profile', default='testing', help='Lighting profile in profiles/')
+    parser.add_argument('--scene', help='Scene to start with (default: the first one)')
+    parser.add_argument('--scenes', default='scenes', help='Scenes directory')
+    parser.add_argument('--self-test', choices=SELF_TEST_MODES, help='Fixture check to run at startup')
+    parser.add_argument('--frame-rate', type=float,
+                        help="Frames per second to send (default: the profile's, or 44); 0 sends one per audio frame")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s: %(message)s')
+
+    audio_listener = AudioListener()
+    scene_manager = SceneManager(args.scenes)
+    if args.scene:
+        scene_manager.set_scene(args.scene)
+    light_controller = LightController(audio_listener, args.profile, scene_manager, self_test=args.self_test,
+                                       frame_rate=args.frame_rate)
+
+    scene_watcher = SceneWatcher(scene_manager)
+    scene_watcher.watch(light_controller.profile_path, light_controller.reload_profile)
+
+    audio_listener.start()
+    light_controller.start()
+    scene_watcher.start()
+
+    try:
+        while True:
+            for error in audio_listener.get_errors() + scene_manager.get_errors() + light_controller.get_errors():
+                print(f"Error: {error}")
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+
+    scene_watcher.stop()
+    audio_listener.stop()
+    light_controller.stop()
+    audio_listener.join()
+    light_controller.join()
+    if light_controller.scheduler is not None:
+        print(light_controller.scheduler.format())
+
+if __name__ == '__main__':
+    main()
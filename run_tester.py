@@ -11,7 +11,7 @@ import curses
 
 from control import load_json, load_profile, load_controller, LightController
 from audio_listener import AudioListener
-from scene_manager import SceneManager
+from scene_manager import SceneManager, SceneWatcher
 
 stdscr = curses.initscr()
 
@@ -22,12 +22,21 @@ def main():
 
     light_controller = LightController(audio_listener, 'testing', scene_manager)
 
-    scene_commands = {ord(scene_manager.scenes[scene]['key_command']): scene for scene in scene_manager.scenes}
+    # picks up edits to the scenes and the profile while running
+    scene_watcher = SceneWatcher(scene_manager)
+    scene_watcher.watch(light_controller.profile_path, light_controller.reload_profile)
 
     audio_listener.start()
     light_controller.start()
+    scene_watcher.start()
+
+    # redraw a few times a second so the latency numbers stay live
+    stdscr.timeout(250)
 
     while True:
+        # scenes can be added or edited while running
+        scene_commands = {ord(scene['key_command']): name for name, scene in scene_manager.scenes.items()
+                          if 'key_command' in scene}
         stdscr.clear()
         stdscr.addstr(0, 0, f"Current scene: {scene_manager.current_scene['name']}")
         stdscr.addstr(1, 0, "Available scenes:")
@@ -35,16 +44,41 @@ def main():
             stdscr.addstr(i+2, 0, f"{scene} | Commands: {scene_manager.scenes[scene]['key_command']}")
         
         # Print any errors from the audio listener
-        errors = audio_listener.get_errors()
+        errors = audio_listener.get_errors() + scene_manager.get_errors() + light_controller.get_errors()
         if errors:
             for i, error in enumerate(errors):
                 stdscr.addstr(i+len(scene_manager.scenes)+3, 0, f"Error: {error}")
+
+        # Latency from the ADC to each stage, for tuning BLOCKSIZE
+        latency_row = len(scene_manager.scenes) + len(errors) + 5
+        stdscr.addstr(latency_row, 0, f"Latency since ADC (block size {audio_listener.block_size}, 'l' to reset):")
+        for i, line in enumerate(audio_listener.latency.format()):
+            stdscr.addstr(latency_row + i + 1, 0, line)
+
+        output_row = latency_row + len(audio_listener.latency.histograms) + 1
+        if light_controller.scheduler is not None:
+            stdscr.addstr(output_row, 0, light_controller.scheduler.format())
+
+        bpm, confidence = audio_listener.get_tempo()
+        tempo_row = output_row + 1
+        if bpm is None:
+            stdscr.addstr(tempo_row, 0, "Tempo: listening...")
+        else:
+            stdscr.addstr(tempo_row, 0, f"Tempo: {bpm:5.1f} BPM (confidence {confidence:.2f})")
+        # logging would write over the screen, so the startup time is shown here instead
+        stdscr.addstr(tempo_row + 1, 0, light_controller.format_startup())
         
         stdscr.refresh()
 
         key = stdscr.getch()
+        if key == -1:
+            continue
         if key == ord('q'):
             break
+        elif key == ord('l'):
+            audio_listener.latency.reset()
+            if light_controller.scheduler is not None:
+                light_controller.scheduler.reset()
         elif key in scene_commands:
             try:
                 light_controller.change_scene(scene_commands[key])
@@ -52,12 +86,13 @@ def main():
             except Exception as e:
                 stdscr.addstr(len(scene_manager.scenes)+2, 0, f"Error changing scene: {str(e)}")
         elif key == ord('r'):
+            # the current scene is recompiled and swapped in without turning the lights off
             scene_manager.reload_scenes()
-            light_controller.change_scene(scene_manager.current_scene['name'])  # Reapply current scene
             stdscr.addstr(len(scene_manager.scenes) + 4, 0, "Scenes reloaded")
         
         stdscr.refresh()
 
+    scene_watcher.stop()
     audio_listener.stop()
     light_controller.stop()
     audio_listener.join()
@@ -0,0 +1,124 @@
+"""
+Provides the SceneCache class, an on-disk cache of parsed, validated scenes and their compiled plans, so that starting
+up with a large scene library doesn't have to read, parse, validate and compile every file again.
+
+Each scene's entry is keyed by its file's mtime and size, the SHA-1 of its contents and CODE_VERSION, a hash of the
+modules that validate and compile scenes and of the audio parameters, which compiled plans bake in (FFT bin counts
+and bounds, mel weights, the onset detector's frame time). A file whose mtime and size are unchanged is used straight
+from the cache without being opened; one that was touched but not changed is recognised by its content hash; anything
+else, or any change to the compiling code or the audio parameters, falls back to a full parse. Compiled plans are
+stored per channel layout and unpickled fresh on each use, so no two scene activations share oscillator or onset
+state.
+"""
+
+import os
+import json
+import pickle
+import hashlib
+from config import audio_parameters
+from scene_plan import ScenePlan, validate_scene
+
+# the modules whose code decides what a parsed scene or compiled plan looks like
+CODE_MODULES = ('scene_plan.py', 'mapping.py', 'palette.py', 'wavetable.py', 'onset.py', 'features.py',
+                'transitions.py')
+INDEX_FILE = 'index.pkl'
+
+def code_version(modules=CODE_MODULES, parameters=audio_parameters):
+    digest = hashlib.sha1()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for module in modules:
+        with open(os.path.join(directory, module), 'rb') as f:
+            digest.update(f.read())
+    # the parameters as loaded, so the key follows whichever audio_parameters.json config.py read
+    digest.update(json.dumps(parameters, sort_keys=True).encode())
+    return digest.hexdigest()
+
+CODE_VERSION = code_version()
+
+def layout_key(layout):
+    return hashlib.sha1(json.dumps(layout, sort_keys=True).encode()).hexdigest()
+
+class SceneCache:
+    def __init__(self, directory='.scene_cache'):
+        self.directory = directory
+        self.path = os.path.join(directory, INDEX_FILE)
+        self.entries = {}  # scene file path -> entry dict
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        try:
+            with open(self.path, 'rb') as f:
+                index = pickle.load(f)
+            if index.get('code_version') == CODE_VERSION:
+                self.entries = index['entries']
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, KeyError, TypeError):
+            pass  # no usable cache, everything is parsed from scratch
+
+    def load_scene(self, path, signature):
+        """
+        Returns the validated scene in the file at path, from the cache if the file hasn't changed.
+
+        Parameters:
+        path (str): The scene's JSON file.
+        signature (tuple): (mtime_ns, size) of the file, see scene_manager.file_signature.
+
+        Raises:
+        OSError, ValueError: If the file can't be read, parsed or validated.
+        """
+        entry = self.entries.get(path)
+        if entry is not None and entry['signature'] == signature:
+            self.hits += 1
+            return entry['scene']
+        with open(path, 'rb') as f:
+            contents = f.read()
+        digest = hashlib.sha1(contents).hexdigest()
+        if entry is not None and entry['sha1'] == digest:
+            # touched but not edited
+            entry['signature'] = signature
+            self.dirty = True
+            self.hits += 1
+            return entry['scene']
+        self.misses += 1
+        scene = json.loads(contents)
+        validate_scene(scene)
+        self.entries[path] = {'signature': signature, 'sha1': digest, 'scene': scene, 'plans': {}}
+        self.dirty = True
+        return scene
+
+    def compile(self, path, scene, layout):
+        """
+        Returns a fresh ScenePlan of the scene from the file at path for a layout, compiling and caching it if
+        needed.
+        """
+        entry = self.entries.get(path)
+        if entry is None or entry['scene'] is not scene:
+            return ScenePlan(scene, layout)
+        key = layout_key(layout)
+        if key in entry['plans']:
+            return pickle.loads(entry['plans'][key])
+        plan = ScenePlan(scene, layout)
+        entry['plans'][key] = pickle.dumps(plan, protocol=pickle.HIGHEST_PROTOCOL)
+        self.dirty = True
+        return plan
+
+    def forget(self, keep):
+        """
+        Drops the entries of scene files that are not in keep.
+        """
+        for path in set(self.entries) - set(keep):
+            del self.entries[path]
+            self.dirty = True
+
+    def save(self):
+        """
+        Writes the cache to disk if anything changed, replacing the old file in one step so a crash mid-write
+        can't leave a corrupt cache behind.
+        """
+        if not self.dirty:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = self.path + '.tmp'
+        with open(temporary, 'wb') as f:
+            pickle.dump({'code_version': CODE_VERSION, 'entries': self.entries}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, self.path)
+        self.dirty = False
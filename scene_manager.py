@@ -1,10 +1,88 @@
+"""
+Provides the SceneManager class, which holds the scenes and the compiled plan of the current one, and the
+SceneWatcher thread, which reloads scenes (and any other watched files, such as the lighting profile) when they
+change on disk so they can be edited live.
+
+Changes are found by polling file modification times, and only the files that changed are parsed again. The light
+thread reads current_plan once per frame, so publishing a recompiled plan is a single reference swap that takes
+effect at the next frame boundary without interrupting the output.
+"""
+
 import os
 import json
+import queue
+import threading
+from scene_plan import ScenePlan, validate_scene
+from scene_cache import SceneCache
+
+def file_signature(path):
+    """
+    Returns (mtime_ns, size) of a file, which changes whenever the file is saved, or None if it doesn't exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
 
 class SceneManager:
-    def __init__(self, scenes_directory):
-        self.scenes = self.load_json_files(scenes_directory)
-        self.current_scene = self.scenes[list(self.scenes.keys())[0]]
+    def __init__(self, scenes_directory='scenes', cache_directory='.scene_cache'):
+        """
+        Parameters:
+        scenes_directory (str): Where the scene JSON files are.
+        cache_directory (str): Where parsed scenes and compiled plans are cached between runs (see SceneCache), or
+            None to always parse and compile from scratch.
+        """
+        self.scenes_directory = scenes_directory
+        self.error_queue = queue.Queue()
+        self.cache = SceneCache(cache_directory) if cache_directory is not None else None
+        self.scenes = {}
+        self._signatures = {}  # file signature of each loaded scene, to find changed files
+        self._lock = threading.RLock()  # serializes compiling and publishing plans
+        self.reload_scenes()
+        self.current_name = list(self.scenes.keys())[0]
+        self.current_scene = self.scenes[self.current_name]
+        self.layout = {}
+        self.current_plan = self.compile(self.current_name)
+
+    def scene_path(self, scene_name):
+        return os.path.join(self.scenes_directory, scene_name + '.json')
+
+    def load_scene(self, scene_name, signature):
+        if self.cache is not None:
+            return self.cache.load_scene(self.scene_path(scene_name), signature)
+        with open(self.scene_path(scene_name), 'r') as file:
+            scene = json.load(file)
+        validate_scene(scene)
+        return scene
+
+    def compile(self, scene_name, layout=None):
+        """
+        Returns a new plan of a loaded scene for a layout (by default the bound one).
+        """
+        layout = self.layout if layout is None else layout
+        scene = self.scenes[scene_name]
+        if self.cache is None:
+            return ScenePlan(scene, layout)
+        plan = self.cache.compile(self.scene_path(scene_name), scene, layout)
+        self.save_cache()
+        return plan
+
+    def save_cache(self):
+        try:
+            self.cache.save()
+        except OSError as e:
+            self.error_queue.put(f"Error saving the scene cache: {str(e)}")
+
+    def bind_layout(self, layout):
+        """
+        Sets the channel layout (universe offset by light name) that scenes are compiled against and recompiles the
+        current scene.
+        """
+        with self._lock:
+            plan = self.compile(self.current_name, layout)
+            self.layout = layout
+            self.current_plan = plan
 
     def load_json_files(self, directory):
         data = {}
@@ -14,14 +92,115 @@ class SceneManager:
                     data[filename[:-5]] = json.load(file)
         return data
 
-    def set_scene(self, scene_name):
-        if scene_name in self.scenes:
-            self.current_scene = self.scenes[scene_name]
-        else:
-            raise ValueError(f"Scene '{scene_name}' not found")
+    def set_scene(self, scene_name, before_publish=None):
+        """
+        Compiles a scene and makes it the current one.
+
+        Parameters:
+        scene_name (str): The scene to switch to.
+        before_publish (function): Called with the new plan just before it becomes current_plan, so a caller can
+            stage whatever the light thread has to see along with it.
+        """
+        with self._lock:
+            if scene_name in self.scenes:
+                plan = self.compile(scene_name)
+                if before_publish is not None:
+                    before_publish(plan)
+                self.current_name = scene_name
+                self.current_scene = self.scenes[scene_name]
+                self.current_plan = plan
+            else:
+                raise ValueError(f"Scene '{scene_name}' not found")
 
     def reload_scenes(self):
-        self.scenes = self.load_json_files('scenes')
+        """
+        Parses the scene files that were added or changed since the last call, drops scenes whose file is gone, and
+        recompiles the current scene if it changed. A file that fails to parse or compile keeps its previous
+        version, and the error goes to error_queue.
+
+        Returns:
+        list: The names of the scenes that were added, changed or removed.
+        """
+        with self._lock:
+            signatures = {}
+            for filename in os.listdir(self.scenes_directory):
+                if filename.endswith('.json'):
+                    signature = file_signature(os.path.join(self.scenes_directory, filename))
+                    if signature is not None:
+                        signatures[filename[:-5]] = signature
+
+            scenes = dict(self.scenes)
+            changed = []
+            for name, signature in signatures.items():
+                if self._signatures.get(name) == signature:
+                    continue
+                try:
+                    scenes[name] = self.load_scene(name, signature)
+                    changed.append(name)
+                except (OSError, ValueError) as e:
+                    self.error_queue.put(f"Error loading scene '{name}': {str(e)}")
+            for name in set(self.scenes) - set(signatures):
+                del scenes[name]
+                changed.append(name)
+            self._signatures = signatures
+            self.scenes = scenes
+            if self.cache is not None:
+                self.cache.forget(self.scene_path(name) for name in signatures)
+                self.save_cache()
+
+            current_name = getattr(self, 'current_name', None)
+            if current_name in changed and current_name in scenes:
+                try:
+                    plan = self.compile(current_name)
+                    self.current_scene = scenes[current_name]
+                    self.current_plan = plan
+                except Exception as e:
+                    self.error_queue.put(f"Error compiling scene '{current_name}': {str(e)}")
+            return changed
+
+    def get_errors(self):
+        errors = []
+        while not self.error_queue.empty():
+            errors.append(self.error_queue.get_nowait())
+        return errors
+
+class SceneWatcher(threading.Thread):
+    """
+    Polls the scenes directory, and any files added with watch(), for changes every interval seconds.
+    """
+    def __init__(self, scene_manager, interval=0.5):
+        threading.Thread.__init__(self, daemon=True)
+        self.scene_manager = scene_manager
+        self.interval = interval
+        self.watched = {}  # path -> [signature, callback]
+        self.stopped = threading.Event()
+
+    def watch(self, path, callback):
+        """
+        Calls callback(path) from the watcher thread whenever the file at path changes.
+        """
+        self.watched[path] = [file_signature(path), callback]
+
+    def poll(self):
+        self.scene_manager.reload_scenes()
+        for path, entry in self.watched.items():
+            signature = file_signature(path)
+            if signature is not None and signature != entry[0]:
+                entry[0] = signature
+                try:
+                    entry[1](path)
+                except Exception as e:
+                    self.scene_manager.error_queue.put(f"Error reloading {path}: {str(e)}")
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                self.scene_manager.error_queue.put(f"Error watching scenes: {str(e)}")
+
+    def stop(self):
+        self.stopped.set()
 
 def main():
     scene_manager = SceneManager('scenes')
@@ -29,4 +208,4 @@ def main():
     print(scene_manager.current_scene)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
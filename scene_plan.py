@@ -0,0 +1,475 @@
+"""
+Compiles a scene dictionary into a ScenePlan: the lights of the scene grouped by modulator and fixture type, with the
+frequency bins, thresholds and universe channel offsets worked out once so that each FFT frame only costs a few NumPy
+operations and a write into the universe buffer.
+"""
+
+import time
+import numpy as np
+from features import mel_band_weights
+from mapping import BandEnergy, powers_to_brightness, freq_to_index
+from palette import PALETTE, COLOR_INDEX, color_index, random_colors, random_values, fade_color, fade_rate
+from onset import OnsetDetector, FRAME_SECONDS
+from wavetable import Oscillators, get_wavetable, make_wavetable
+from transitions import TRANSITIONS
+
+RGB_CHANNELS = 6  # dimmer, red, green, blue, strobe, function
+
+def light_band(light):
+    """
+    Returns the band a light listens to: its frequency_range, or the weights of its mel_band (an index into the mel
+    filterbank) or mel_range ([first, last) mel bands).
+    """
+    if 'mel_band' in light:
+        return mel_band_weights(int(light['mel_band']))
+    if 'mel_range' in light:
+        return mel_band_weights(tuple(light['mel_range']))
+    return light['frequency_range']
+
+class FFTGroup:
+    """
+    All the FFT-modulated lights of one fixture type in a scene. Their band energies are the slice
+    [band_start, band_stop) of the scene's BandEnergy output.
+    """
+    def __init__(self, lights, offsets, band_start):
+        self.names = [light['name'] for light in lights]
+        self.offsets = np.array(offsets, dtype=np.intp)
+        self.bands = [light_band(light) for light in lights]
+        self.band_start = band_start
+        self.band_stop = band_start + len(lights)
+
+    def __len__(self):
+        return len(self.offsets)
+
+class FFTDimmers(FFTGroup):
+    def __init__(self, lights, offsets, band_start):
+        super().__init__(lights, offsets, band_start)
+        self.power_low = np.array([light['power_range'][0] for light in lights], dtype=np.float64)
+        self.power_high = np.array([light['power_range'][1] for light in lights], dtype=np.float64)
+        self.brightness_low = np.array([light['brightness_range'][0] for light in lights], dtype=np.float64)
+        self.brightness_high = np.array([light['brightness_range'][1] for light in lights], dtype=np.float64)
+
+    def brightness(self, energies):
+        return powers_to_brightness(energies[self.band_start:self.band_stop], self.power_low, self.power_high,
+                                    self.brightness_low, self.brightness_high)
+
+    def render(self, energies, universe):
+        universe[self.offsets] = np.clip(self.brightness(energies), 0, 255)
+
+class FFTRGBs(FFTDimmers):
+    def __init__(self, lights, offsets, band_start):
+        super().__init__(lights, offsets, band_start)
+        self.channels = self.offsets[:, None] + np.arange(RGB_CHANNELS)
+        # the color and strobe channels don't depend on the audio, so they are filled in once
+        self.values = np.zeros((len(lights), RGB_CHANNELS), dtype=np.uint8)
+        self.random_color = np.zeros(len(lights), dtype=bool)
+        for i, light in enumerate(lights):
+            color = light.get('color', 'random')
+            if color == 'random':
+                self.random_color[i] = True
+            else:
+                self.values[i, 1:4] = PALETTE[color_index(color)]
+            self.values[i, 4] = light.get('strobe', 0)
+        self.random_rows = np.flatnonzero(self.random_color)
+
+    def render(self, energies, universe):
+        self.values[:, 0] = np.clip(self.brightness(energies), 0, 255)
+        if len(self.random_rows):
+            self.values[self.random_rows, 1:4] = random_colors(len(self.random_rows))
+        universe[self.channels] = self.values
+
+class FFTStrobes(FFTGroup):
+    def __init__(self, lights, offsets, band_start):
+        super().__init__(lights, offsets, band_start)
+        self.channels = self.offsets[:, None] + np.arange(2)
+        self.threshold = np.array([light['power_range'][0] for light in lights], dtype=np.float64)
+
+    def render(self, energies, universe):
+        on = energies[self.band_start:self.band_stop] >= self.threshold
+        universe[self.channels] = np.where(on, 255, 0)[:, None]
+
+class OnsetLights:
+    """
+    All the onset-modulated lights of a scene. Each light has its own band in an OnsetDetector; an onset sets its
+    level to 1, which then decays exponentially with the light's decay time (seconds) and is mapped onto its
+    brightness_range. Strobes are on while the level is above one half, and random-colored RGBs pick a new color on
+    every onset.
+    """
+    def __init__(self, lights, offsets):
+        self.names = [light['name'] for light in lights]
+        offsets = np.array(offsets, dtype=np.intp)
+        self.detector = OnsetDetector([light_band(light) for light in lights],
+                                      sensitivity=[light.get('sensitivity', 1.5) for light in lights],
+                                      min_interval=min(light.get('min_interval', 0.1) for light in lights))
+        self.level = np.zeros(len(lights), dtype=np.float64)
+        self.decay = np.exp(-FRAME_SECONDS / np.array([max(light.get('decay', 0.2), 1e-3) for light in lights]))
+        brightness_range = [light.get('brightness_range', [0, 255]) for light in lights]
+        self.brightness_low = np.array([low for low, _ in brightness_range], dtype=np.float64)
+        self.brightness_high = np.array([high for _, high in brightness_range], dtype=np.float64)
+        types = np.array([light['type'] for light in lights])
+
+        self.dimmer_rows = np.flatnonzero(types == 'dimmer')
+        self.dimmer_offsets = offsets[self.dimmer_rows]
+
+        self.rgb_rows = np.flatnonzero(types == 'rgb')
+        self.rgb_channels = offsets[self.rgb_rows, None] + np.arange(RGB_CHANNELS)
+        self.rgb_values = np.zeros((len(self.rgb_rows), RGB_CHANNELS), dtype=np.uint8)
+        random_rgb = []
+        for i, row in enumerate(self.rgb_rows):
+            color = lights[row].get('color', 'random')
+            if color == 'random':
+                random_rgb.append(i)
+                self.rgb_values[i, 1:4] = random_colors(1)[0]
+            else:
+                self.rgb_values[i, 1:4] = PALETTE[color_index(color)]
+            self.rgb_values[i, 4] = lights[row].get('strobe', 0)
+        self.random_rgb = np.array(random_rgb, dtype=np.intp)
+        self.random_rgb_rows = self.rgb_rows[self.random_rgb]
+
+        self.strobe_rows = np.flatnonzero(types == 'strobe')
+        self.strobe_channels = offsets[self.strobe_rows, None] + np.arange(2)
+
+    def __len__(self):
+        return len(self.level)
+
+    def render(self, fft_data, universe):
+        onsets = self.detector.process(fft_data)
+        self.level *= self.decay
+        self.level[onsets] = 1.0
+        brightness = self.brightness_low + (self.brightness_high - self.brightness_low) * self.level
+        np.clip(brightness, 0, 255, out=brightness)
+
+        if len(self.dimmer_rows):
+            universe[self.dimmer_offsets] = brightness[self.dimmer_rows]
+        if len(self.rgb_rows):
+            self.rgb_values[:, 0] = brightness[self.rgb_rows]
+            if len(self.random_rgb):
+                hit = self.random_rgb[onsets[self.random_rgb_rows]]
+                if len(hit):
+                    self.rgb_values[hit, 1:4] = random_colors(len(hit))
+            universe[self.rgb_channels] = self.rgb_values
+        if len(self.strobe_rows):
+            universe[self.strobe_channels] = np.where(self.level[self.strobe_rows] > 0.5, 255, 0)[:, None]
+
+class TimeLights:
+    """
+    All the time-modulated lights of a scene, driven by one bank of wavetable oscillators. Frequencies are in Hz, or
+    in cycles per beat (0.25 is once a bar, 2 is twice a beat) for lights with "sync": "beat", which follow the beat
+    position from the tempo tracker. A light's function is a wavetable name or a list of levels for a custom wave.
+    Every channel that moves with the wave is stored as a (low, high) pair and a row into the oscillator levels, so a
+    frame is one oscillator step and one scatter into the universe; fixed channels have low == high.
+    """
+    def __init__(self, lights, offsets):
+        self.names = [light['name'] for light in lights]
+        self.oscillators = Oscillators([light['function'] for light in lights],
+                                       [light['frequency'] for light in lights],
+                                       [light.get('sync') == 'beat' for light in lights])
+        channels, low, high, rows = [], [], [], []
+        self.random_colors = []  # offsets of the red channel of RGBs with a random color
+        self.random_strobes = []  # channels of RGBs with a random strobe
+
+        def add(channel, row, channel_low, channel_high=None):
+            channels.append(channel)
+            rows.append(row)
+            low.append(channel_low)
+            high.append(channel_low if channel_high is None else channel_high)
+
+        for row, (light, offset) in enumerate(zip(lights, offsets)):
+            if light['type'] in ('dimmer', 'rgb'):
+                add(offset, row, light['min_brightness'], light['max_brightness'])
+            if light['type'] == 'rgb':
+                if light['color'] == 'random':
+                    self.random_colors.append(offset + 1 + np.arange(3))
+                else:
+                    for i, value in enumerate(PALETTE[color_index(light['color'])]):
+                        add(offset + 1 + i, row, value)
+                strobe = light.get('strobe', 0)
+                if strobe == 'random':
+                    self.random_strobes.append(offset + 4)
+                else:
+                    add(offset + 4, row, strobe)
+                add(offset + 5, row, 0)
+            elif light['type'] == 'strobe':
+                target = light['target']
+                if target in ('speed', 'both'):
+                    add(offset, row, *light['speed_range'])
+                else:
+                    add(offset, row, light['speed'])
+                if target in ('brightness', 'both'):
+                    add(offset + 1, row, *light['brightness_range'])
+                else:
+                    add(offset + 1, row, light['brightness'])
+        self.channels = np.array(channels, dtype=np.intp)
+        self.rows = np.array(rows, dtype=np.intp)
+        self.low = np.array(low, dtype=np.float64)
+        self.span = np.array(high, dtype=np.float64) - self.low
+        self.random_colors = np.array(self.random_colors, dtype=np.intp).reshape(-1, 3)
+        self.random_strobes = np.array(self.random_strobes, dtype=np.intp)
+
+    def __len__(self):
+        return len(self.oscillators)
+
+    def render(self, now, beats, universe):
+        level = self.oscillators.advance(now, beats)
+        universe[self.channels] = np.clip(self.low + self.span * level[self.rows], 0, 255)
+        if len(self.random_colors):
+            universe[self.random_colors] = random_colors(len(self.random_colors))
+        if len(self.random_strobes):
+            universe[self.random_strobes] = random_values(len(self.random_strobes))
+
+FFT_GROUPS = {
+    'dimmer': FFTDimmers,
+    'rgb': FFTRGBs,
+    'strobe': FFTStrobes,
+}
+
+class BoolLights:
+    """
+    All the bool-modulated lights of a scene. Fixed values are written from one array; 'random' values and colors
+    are drawn together from the palette's random stream each frame, and RGBs with a colorfade (0-255) fade through
+    the palette's HSV fade table, each from its own starting color, at a speed set by the colorfade.
+    """
+    def __init__(self, lights, offsets):
+        self.names = [light['name'] for light in lights]
+        channels, values = [], []
+        random_channels, color_channels, fade_channels, rates = [], [], [], []
+
+        def add(channel, value):
+            if value == 'random':
+                random_channels.append(channel)
+            else:
+                channels.append(channel)
+                values.append(value)
+
+        for light, offset in zip(lights, offsets):
+            if light['type'] == 'dimmer':
+                add(offset, light['brightness'])
+            elif light['type'] == 'rgb':
+                add(offset, light['brightness'])
+                rgb = offset + 1 + np.arange(3)
+                if light.get('colorfade', 0):
+                    fade_channels.append(rgb)
+                    rates.append(fade_rate(light['colorfade']))
+                elif light.get('color', 'random') == 'random':
+                    color_channels.append(rgb)
+                else:
+                    channels.extend(rgb)
+                    values.extend(PALETTE[color_index(light['color'])])
+                add(offset + 4, light.get('strobe', 0))
+                add(offset + 5, 0)
+            elif light['type'] == 'strobe':
+                add(offset, light['speed'])
+                add(offset + 1, light['brightness'])
+        self.channels = np.array(channels, dtype=np.intp)
+        self.values = np.clip(np.array(values, dtype=np.int64), 0, 255).astype(np.uint8)
+        self.random_channels = np.array(random_channels, dtype=np.intp)
+        self.color_channels = np.array(color_channels, dtype=np.intp).reshape(-1, 3)
+        self.fade_channels = np.array(fade_channels, dtype=np.intp).reshape(-1, 3)
+        self.fade_rate = np.array(rates, dtype=np.float64)
+        # spread the fading lights around the palette so they don't all show the same color
+        self.fade_position = np.arange(len(rates), dtype=np.float64) * len(PALETTE) / max(len(rates), 1)
+        self.last_time = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def render(self, now, universe):
+        universe[self.channels] = self.values
+        if len(self.random_channels):
+            universe[self.random_channels] = random_values(len(self.random_channels))
+        if len(self.color_channels):
+            universe[self.color_channels] = random_colors(len(self.color_channels))
+        if len(self.fade_channels):
+            if self.last_time is not None:
+                self.fade_position += self.fade_rate * max(now - self.last_time, 0.0)
+                np.mod(self.fade_position, len(PALETTE), out=self.fade_position)
+            self.last_time = now
+            universe[self.fade_channels] = fade_color(self.fade_position)
+
+MODULATORS = ('fft', 'onset', 'bool', 'time')
+BAND_KEYS = ('frequency_range', 'mel_band', 'mel_range')
+
+# keys each modulator needs for each fixture type, besides a band for fft and onset lights
+REQUIRED_KEYS = {
+    ('fft', 'dimmer'): ('power_range', 'brightness_range'),
+    ('fft', 'rgb'): ('power_range', 'brightness_range'),
+    ('fft', 'strobe'): ('power_range',),
+    ('bool', 'dimmer'): ('brightness',),
+    ('bool', 'rgb'): ('brightness',),
+    ('bool', 'strobe'): ('speed', 'brightness'),
+    ('time', 'dimmer'): ('function', 'frequency', 'min_brightness', 'max_brightness'),
+    ('time', 'rgb'): ('function', 'frequency', 'min_brightness', 'max_brightness', 'color'),
+    ('time', 'strobe'): ('function', 'frequency', 'target'),
+}
+
+def band_problem(light):
+    """
+    Returns what is wrong with a light's band (see light_band), or None if it can be compiled.
+    """
+    if 'mel_band' not in light and 'mel_range' not in light:
+        band = light['frequency_range']
+        if not isinstance(band, (list, tuple)) or len(band) != 2:
+            return f"frequency_range {band!r} is not a [low, high] pair"
+    try:
+        band = light_band(light)
+        if 'mel_band' not in light and 'mel_range' not in light:
+            freq_to_index(band[0]), freq_to_index(band[1])
+    except (ValueError, TypeError) as e:
+        return str(e)
+    return None
+
+def function_problem(function):
+    """
+    Returns what is wrong with a time light's function, a wavetable name or a list of levels, or None if it is usable.
+    """
+    try:
+        if isinstance(function, str):
+            get_wavetable(function)
+        else:
+            make_wavetable(function)
+    except (ValueError, TypeError) as e:
+        return str(e)
+    return None
+
+def validate_scene(scene):
+    """
+    Checks that a scene has everything its lights need to be compiled, and that their bands and functions exist, so
+    a broken scene is reported when it is loaded rather than when it is first set.
+
+    Raises:
+    ValueError: Listing every problem found.
+    """
+    if not isinstance(scene, dict) or not isinstance(scene.get('lights'), list):
+        raise ValueError("A scene needs a list of lights")
+    problems = []
+    for i, light in enumerate(scene['lights']):
+        name = light.get('name', f'light {i}')
+        modulator, light_type = light.get('modulator'), light.get('type')
+        if 'name' not in light:
+            problems.append(f"{name} has no name")
+        if light_type not in FFT_GROUPS:
+            problems.append(f"{name} has unknown type '{light_type}'")
+            continue
+        if modulator not in MODULATORS:
+            problems.append(f"{name} has unknown modulator '{modulator}'")
+            continue
+        missing = [key for key in REQUIRED_KEYS.get((modulator, light_type), ()) if key not in light]
+        if modulator in ('fft', 'onset') and not any(key in light for key in BAND_KEYS):
+            missing.append(' or '.join(BAND_KEYS))
+        if modulator == 'time' and light_type == 'strobe':
+            target = light.get('target')
+            if target in ('speed', 'both') and 'speed_range' not in light:
+                missing.append('speed_range')
+            if target in ('brightness', 'both') and 'brightness_range' not in light:
+                missing.append('brightness_range')
+        if missing:
+            problems.append(f"{name} ({modulator} {light_type}) is missing {', '.join(missing)}")
+        if modulator in ('fft', 'onset') and any(key in light for key in BAND_KEYS):
+            problem = band_problem(light)
+            if problem:
+                problems.append(f"{name} has an invalid band: {problem}")
+        if modulator == 'time' and 'function' in light:
+            problem = function_problem(light['function'])
+            if problem:
+                problems.append(f"{name} has an invalid function: {problem}")
+        color = light.get('color', 'random')
+        if color != 'random' and color not in COLOR_INDEX:
+            problems.append(f"{name} has unknown color '{color}'")
+    transition = scene.get('transition')
+    if transition is not None and transition not in TRANSITIONS:
+        problems.append(f"unknown transition '{transition}'")
+    if problems:
+        raise ValueError(f"Scene '{scene.get('name')}' is invalid: " + '; '.join(problems))
+
+class ScenePlan:
+    def __init__(self, scene, layout):
+        """
+        Parameters:
+        scene (dict): The scene as loaded from its JSON file.
+        layout (dict): The universe offset of each light by name. Lights of the scene that are not in it are left out.
+        """
+        self.scene = scene
+        self.name = scene.get('name')
+        self.fft_groups = []
+        self.bool_lights = None
+        self.onset_lights = None
+        self.time_lights = None
+
+        fft_lights = {light_type: [] for light_type in FFT_GROUPS}
+        onset_lights = []
+        bool_lights = []
+        time_lights = []
+        for light in scene['lights']:
+            offset = layout.get(light.get('name'))
+            if offset is None:
+                continue  # Skip lights not in the profile
+            modulator = light.get('modulator')
+            light_type = light.get('type')
+            if modulator == 'fft' and light_type in FFT_GROUPS:
+                fft_lights[light_type].append((light, offset))
+            elif modulator == 'onset' and light_type in FFT_GROUPS:
+                onset_lights.append((light, offset))
+            elif modulator == 'bool' and light_type in FFT_GROUPS:
+                bool_lights.append((light, offset))
+            elif modulator == 'time' and light_type in FFT_GROUPS:
+                time_lights.append((light, offset))
+        band_start = 0
+        for light_type, entries in fft_lights.items():
+            if entries:
+                lights, offsets = zip(*entries)
+                self.fft_groups.append(FFT_GROUPS[light_type](list(lights), list(offsets), band_start))
+                band_start += len(lights)
+        # one band per FFT light, in group order
+        self.band_energy = BandEnergy([band for group in self.fft_groups for band in group.bands])
+        if onset_lights:
+            lights, offsets = zip(*onset_lights)
+            self.onset_lights = OnsetLights(list(lights), list(offsets))
+        if bool_lights:
+            lights, offsets = zip(*bool_lights)
+            self.bool_lights = BoolLights(list(lights), list(offsets))
+        if time_lights:
+            lights, offsets = zip(*time_lights)
+            self.time_lights = TimeLights(list(lights), list(offsets))
+
+    def render(self, fft_data, universe, beats=None, now=None):
+        """
+        Writes one frame of the scene into a universe buffer.
+
+        Parameters:
+        fft_data (np.array): The FFT magnitude vector of the current audio block.
+        universe (np.array): The uint8 universe buffer to write into.
+        beats (float): The beat position of the frame from the tempo tracker (see TempoTracker.beats). Without one,
+            beat-synced lights run at a free 120 BPM.
+        now (float): The time of the frame in seconds, the one clock sample the time lights and color fades advance
+            to. Defaults to time.monotonic().
+        """
+        self.render_audio(fft_data, universe)
+        self.render_clock(universe, beats, now)
+
+    def render_audio(self, fft_data, universe):
+        """
+        Writes the lights that follow the audio (fft and onset) for one FFT frame. Onset levels decay by one audio
+        frame per call, so call it for every frame, even when the output runs at a different rate.
+        """
+        if self.fft_groups:
+            energies = self.band_energy(fft_data)
+            for group in self.fft_groups:
+                group.render(energies, universe)
+
+        if self.onset_lights is not None:
+            self.onset_lights.render(fft_data, universe)
+
+    def render_clock(self, universe, beats=None, now=None):
+        """
+        Writes the lights that follow the clock (time and bool) at time now and beat position beats, see render.
+        """
+        if now is None:
+            now = time.monotonic()
+
+        if self.time_lights is not None:
+            if beats is None:
+                beats = now * 2.0
+            self.time_lights.render(now, beats, universe)
+
+        if self.bool_lights is not None:
+            self.bool_lights.render(now, universe)
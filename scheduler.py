@@ -0,0 +1,66 @@
+"""
+Provides the FrameScheduler class, the fixed-rate clock the light thread sends frames on, independent of how often
+audio frames arrive.
+
+Deadlines are kept on time.monotonic() and advance by exactly one period per frame, so sleep overshoot doesn't add up
+into drift. A thread that falls more than a whole period behind skips the deadlines it can no longer make instead of
+sending a burst of frames to catch up, and counts them as missed. How late each frame wakes after its deadline is
+recorded in a histogram.
+"""
+
+import time
+from latency import LatencyHistogram
+from outputs import DEFAULT_REFRESH_RATE
+
+class FrameScheduler:
+    def __init__(self, frame_rate=DEFAULT_REFRESH_RATE, clock=time.monotonic, sleep=time.sleep):
+        """
+        Parameters:
+        frame_rate (float): Frames per second.
+        clock (function): Returns the time in seconds.
+        sleep (function): Sleeps for a number of seconds.
+        """
+        if frame_rate <= 0:
+            raise ValueError(f"The frame rate has to be positive, got {frame_rate}")
+        self.frame_rate = frame_rate
+        self.period = 1.0 / frame_rate
+        self.clock = clock
+        self.sleep = sleep
+        self.deadline = None
+        self.frames = 0
+        self.missed = 0
+        self.jitter = LatencyHistogram(max_ms=50.0, resolution_ms=0.05)
+
+    def wait(self):
+        """
+        Sleeps until the next frame's deadline.
+
+        Returns:
+        float: The deadline, the time the frame is for.
+        """
+        now = self.clock()
+        if self.deadline is None:
+            self.deadline = now
+        else:
+            self.deadline += self.period
+            if now - self.deadline >= self.period:
+                skipped = int((now - self.deadline) / self.period)
+                self.missed += skipped
+                self.deadline += skipped * self.period
+        delay = self.deadline - now
+        if delay > 0:
+            self.sleep(delay)
+        self.jitter.record(self.clock() - self.deadline)
+        self.frames += 1
+        return self.deadline
+
+    def reset(self):
+        self.frames = 0
+        self.missed = 0
+        self.jitter.reset()
+
+    def format(self):
+        if self.frames == 0:
+            return f"Output {self.frame_rate:.0f} Hz: no frames yet"
+        return (f"Output {self.frame_rate:.0f} Hz: {self.frames} frames, {self.missed} missed deadlines, "
+                f"jitter p50 {self.jitter.percentile(50):.2f} ms  p99 {self.jitter.percentile(99):.2f} ms")
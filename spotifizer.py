@@ -1,7 +1,12 @@
+import os
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials, SpotifyOAuth
 import threading
 import queue
+from playback import PlaybackService
+
+# reading the playback state needs these
+scopes = 'user-read-playback-state user-read-currently-playing'
 
 # get the client id and client secret from the text file
 with open('spotify_credentials.txt') as f:
@@ -32,36 +37,40 @@ user = sp.user(username)
 sp.user = user
 
 class Spotifizer(threading.Thread):
-    def __init__(self):
+    def __init__(self, playback=None):
+        """
+        Parameters:
+        playback (PlaybackService): Where track changes come from. By default one is made with the user's token.
+        """
         super().__init__()
         self.audio_queue = queue.Queue()
         self.running = threading.Event()
         self.error_queue = queue.Queue()
+        self.playback = playback if playback is not None else PlaybackService(token)
+        self.audio_analysis = None
 
     def run(self):
         self.running.set()
-        try:
-            while self.running.is_set():
-                # get the current track
-                current_track = sp.current_playback()
-                if current_track:
-                    track_name = current_track['item']['name']
-                    artist_name = current_track['item']['artists'][0]['name']
-                    self.audio_queue.put(f"Currently playing: {track_name} by {artist_name}")
-                    
-                    # get the audio analysis of the current track
-                    audio_analysis = sp.audio_analysis(track_id)
-
-                    # get the audio features of the current track
-
-
-                else:
-                    self.audio_queue.put("No track currently playing")
-        except Exception as e:
-            self.error_queue.put(f"Error in audio stream: {str(e)}")
+        self.playback.start()
+        while self.running.is_set():
+            event = self.playback.get_event(timeout=0.5)
+            for error in self.playback.get_errors():
+                self.error_queue.put(error)
+            if event is None:
+                continue
+            if event['track_id'] is None:
+                self.audio_queue.put("No track currently playing")
+                continue
+            self.audio_queue.put(f"Currently playing: {event['name']} by {', '.join(event['artists'])}")
+            try:
+                # once per track, not on every poll
+                self.audio_analysis = sp.audio_analysis(event['track_id'])
+            except Exception as e:
+                self.error_queue.put(f"Error getting the audio analysis: {str(e)}")
 
     def stop(self):
         self.running.clear()
+        self.playback.stop()
 
     def get_audio_data(self):
         try:
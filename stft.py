@@ -0,0 +1,95 @@
+"""
+Provides the STFT class, a streaming short-time Fourier transform over a sliding sample history. The window length,
+hop size and window function are independent of the audio callback's block size, so the lights can be updated every
+few milliseconds while the window stays long enough to resolve bass frequencies.
+"""
+
+import numpy as np
+
+WINDOWS = {
+    'hann': np.hanning,
+    'hamming': np.hamming,
+    'blackman': np.blackman,
+    'bartlett': np.bartlett,
+    'rectangular': np.ones,
+}
+
+def make_window(name, length):
+    """
+    Returns the named window, scaled to a mean of 1 so that magnitudes stay comparable with an unwindowed FFT of the
+    same length (and the power ranges in the scenes keep their meaning).
+    """
+    if name not in WINDOWS:
+        raise ValueError(f"Window '{name}' not found. Options are: {', '.join(WINDOWS)}")
+    window = WINDOWS[name](length).astype(np.float32)
+    return window / window.mean()
+
+class STFT:
+    def __init__(self, window_length, hop_size, window='hann', sample_rate=None):
+        """
+        Parameters:
+        window_length (int): The number of samples in each analysis window (the FFT size).
+        hop_size (int): The number of new samples between consecutive frames.
+        window (str): The window function, one of WINDOWS.
+        sample_rate (int): Used to timestamp frames within a block.
+        """
+        if hop_size < 1 or hop_size > window_length:
+            raise ValueError(f"Hop size must be between 1 and the window length ({window_length}), got {hop_size}")
+        self.window_length = window_length
+        self.hop_size = hop_size
+        self.sample_rate = sample_rate
+        self.n_bins = window_length // 2 + 1
+        self.window = make_window(window, window_length)
+        self.history = np.zeros(window_length, dtype=np.float32)
+        self.magnitude = np.zeros(self.n_bins, dtype=np.float32)
+        self._windowed = np.zeros(window_length, dtype=np.float32)
+        self._spectrum = np.zeros(self.n_bins, dtype=np.complex64)
+        self._since_frame = 0  # samples pushed since the last frame
+        self._rfft_out = self._supports_rfft_out()
+
+    def _supports_rfft_out(self):
+        # NumPy 2 can write the FFT into a preallocated array
+        try:
+            np.fft.rfft(self._windowed, out=self._spectrum)
+            return True
+        except TypeError:
+            return False
+
+    def _frame(self):
+        np.multiply(self.history, self.window, out=self._windowed)
+        if self._rfft_out:
+            np.fft.rfft(self._windowed, out=self._spectrum)
+            np.abs(self._spectrum, out=self.magnitude)
+        else:
+            np.abs(np.fft.rfft(self._windowed), out=self.magnitude)
+        return self.magnitude
+
+    def push(self, samples, timestamp, emit):
+        """
+        Appends a block of samples and calls emit(magnitude, frame_timestamp) for every hop completed within it.
+        The magnitude array is reused for the next frame, so emit has to copy it if it keeps it.
+
+        Parameters:
+        samples (np.array): The new mono samples.
+        timestamp (float): The time of the first sample of the block.
+        emit (function): Called with each new magnitude frame and the time of its last sample.
+
+        Returns:
+        int: The number of frames emitted.
+        """
+        emitted = 0
+        pos = 0
+        n = len(samples)
+        while pos < n:
+            take = min(self.hop_size - self._since_frame, n - pos)
+            # slide the history left and append the new samples
+            self.history[:-take] = self.history[take:]
+            self.history[-take:] = samples[pos:pos + take]
+            pos += take
+            self._since_frame += take
+            if self._since_frame == self.hop_size:
+                self._since_frame = 0
+                frame_time = timestamp + pos / self.sample_rate if self.sample_rate else timestamp
+                emit(self._frame(), frame_time)
+                emitted += 1
+        return emitted
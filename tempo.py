@@ -0,0 +1,106 @@
+"""
+Provides the TempoTracker class, which estimates the tempo and beat phase of the music from the onset envelope (the
+total spectral flux of each FFT frame, see onset.py).
+
+The envelope goes into a fixed ring buffer. Every update_interval seconds the tracker autocorrelates the buffer (one
+FFT), picks the strongest beat period between min_bpm and max_bpm, and lines up a comb of beats at that period with
+the envelope to find where the last beat fell. Between updates the beat position is a linear function of time, so
+looking it up for every light on every frame costs a subtraction and a multiply.
+"""
+
+import numpy as np
+from onset import FRAME_SECONDS
+
+class TempoTracker:
+    def __init__(self, frame_seconds=FRAME_SECONDS, history_seconds=8.0, update_interval=0.5, min_bpm=60.0,
+                 max_bpm=180.0, default_bpm=120.0):
+        """
+        Parameters:
+        frame_seconds (float): The time between consecutive envelope values.
+        history_seconds (float): How much of the envelope the tempo is estimated from.
+        update_interval (float): How often the estimate is refreshed, in seconds.
+        min_bpm, max_bpm (float): The range of tempos considered.
+        default_bpm (float): The tempo the beat clock runs at until there is enough history for an estimate.
+        """
+        if not 0 < min_bpm < max_bpm:
+            raise ValueError(f"Invalid tempo range {min_bpm}-{max_bpm} BPM")
+        self.frame_seconds = frame_seconds
+        self.size = int(round(history_seconds / frame_seconds))
+        self.min_lag = max(1, int(np.floor(60.0 / max_bpm / frame_seconds)))
+        self.max_lag = int(np.ceil(60.0 / min_bpm / frame_seconds))
+        if self.max_lag * 2 > self.size:
+            raise ValueError(f"{history_seconds} s of history is too short for tempos down to {min_bpm} BPM")
+        self.update_frames = max(1, int(round(update_interval / frame_seconds)))
+        self.envelope = np.zeros(self.size, dtype=np.float32)
+        self.position = 0  # next write index
+        self.frames = 0
+        self._fft_size = 1 << int(np.ceil(np.log2(2 * self.size)))
+        # a broad log-normal preference around 120 BPM, so a half- or double-time peak of similar height loses
+        lags = np.arange(self.min_lag, self.max_lag + 1) * frame_seconds
+        self._prior = np.exp(-0.5 * np.log2(lags / 0.5) ** 2)
+
+        self.bpm = None  # None until the first estimate
+        self.confidence = 0.0
+        self.default_period = 60.0 / default_bpm
+        # (anchor_beat, anchor, period): beat number anchor_beat fell at time anchor, and beats come every period
+        # seconds. The light thread reads it while the listener thread updates it, so it is only ever replaced whole.
+        self.beat_clock = None
+        self.latest_time = None
+
+    def process(self, strength, timestamp):
+        """
+        Appends the onset strength of the frame at timestamp, refreshing the estimate every update_interval.
+        """
+        self.envelope[self.position] = strength
+        self.position = (self.position + 1) % self.size
+        self.frames += 1
+        self.latest_time = timestamp
+        if self.beat_clock is None:
+            self.beat_clock = (0.0, timestamp, self.default_period)
+        if self.frames >= self.size // 2 and self.frames % self.update_frames == 0:
+            self.update()
+
+    def update(self):
+        n = min(self.frames, self.size)
+        # oldest first
+        envelope = np.roll(self.envelope, -self.position)[-n:].astype(np.float64)
+        envelope -= envelope.mean()
+        spectrum = np.fft.rfft(envelope, self._fft_size)
+        autocorrelation = np.fft.irfft(spectrum * np.conj(spectrum), self._fft_size)[:self.max_lag + 2]
+        if autocorrelation[0] <= 0:
+            return  # silence
+
+        scores = autocorrelation[self.min_lag:self.max_lag + 1] * self._prior
+        lag = int(np.argmax(scores)) + self.min_lag
+        # parabolic interpolation between the neighbouring lags for a sub-frame period
+        before, peak, after = autocorrelation[lag - 1], autocorrelation[lag], autocorrelation[lag + 1]
+        curvature = before - 2 * peak + after
+        offset = 0.5 * (before - after) / curvature if curvature < 0 else 0.0
+        period_frames = lag + float(np.clip(offset, -0.5, 0.5))
+
+        # slide a comb of beats at that period back from the newest frame and keep the best alignment
+        n_beats = max(1, int((n - lag) // period_frames))
+        comb = np.round(np.arange(n_beats) * period_frames).astype(np.intp)
+        positions = np.maximum((n - 1) - np.arange(lag)[:, None] - comb[None, :], 0)
+        alignment = int(np.argmax(envelope[positions].sum(axis=1)))
+        last_beat = self.latest_time - alignment * self.frame_seconds
+
+        # keep the beat count continuous across re-estimates, so beat-fraction waves don't jump
+        period = period_frames * self.frame_seconds
+        self.beat_clock = (round(self.beats(last_beat)), last_beat, period)
+        self.bpm = 60.0 / period
+        self.confidence = float(autocorrelation[lag] / autocorrelation[0])
+
+    def beats(self, timestamp):
+        """
+        Returns the beat position at timestamp: the number of beats since the tracker started, with the fractional
+        part being the phase within the current beat (0 on the beat).
+        """
+        beat_clock = self.beat_clock  # one reference, so all three values come from the same estimate
+        if beat_clock is None:
+            return 0.0
+        anchor_beat, anchor, period = beat_clock
+        return anchor_beat + (timestamp - anchor) / period
+
+    def phase(self, timestamp):
+        return self.beats(timestamp) % 1.0
@@ -0,0 +1,115 @@
+"""
+Provides the TrackIndex class, a persistent map from Spotify track id to the track's scene, cluster and cached audio
+features.
+
+The index lives in an SQLite file and is read into a dict once when opened, so looking a track up on a track change is
+one dict access. Tracks are added one at a time as they get classified, each insert written through to the file, and a
+playlist CSV (as made by get_playlist_df) can be imported in one transaction.
+"""
+
+import csv
+import json
+import sqlite3
+import threading
+
+# the Spotify audio features kept for each track
+FEATURE_COLUMNS = ('danceability', 'energy', 'key', 'loudness', 'mode', 'speechiness', 'acousticness',
+                   'instrumentalness', 'liveness', 'valence', 'tempo', 'duration_ms', 'time_signature')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tracks (
+    id TEXT PRIMARY KEY,
+    scene TEXT,
+    cluster INTEGER,
+    features TEXT
+)
+'''
+
+def _optional(value, cast=str):
+    # empty CSV cells (and pandas' NaN) mean "not classified yet"
+    if value is None or value == '' or value != value:
+        return None
+    return cast(value)
+
+class TrackIndex:
+    def __init__(self, path='tracks.db'):
+        """
+        Parameters:
+        path (str): The SQLite file, created if it doesn't exist. ':memory:' keeps the index in memory only.
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(SCHEMA)
+        self.connection.commit()
+        self._lock = threading.Lock()  # serializes writes from the playback and classification threads
+        self.tracks = {}
+        for track_id, scene, cluster, features in self.connection.execute('SELECT id, scene, cluster, features FROM tracks'):
+            self.tracks[track_id] = {'scene': scene, 'cluster': cluster,
+                                     'features': json.loads(features) if features else {}}
+
+    def __contains__(self, track_id):
+        return track_id in self.tracks
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def get(self, track_id):
+        """
+        Returns a track's entry, a dict with its scene, cluster and features, or None if it isn't indexed.
+        """
+        return self.tracks.get(track_id)
+
+    def scene(self, track_id, default=None):
+        entry = self.tracks.get(track_id)
+        if entry is None or entry['scene'] is None:
+            return default
+        return entry['scene']
+
+    def add(self, track_id, scene=None, cluster=None, features=None):
+        """
+        Adds a track, or updates it. Values left as None keep what the index already has.
+        """
+        self.add_many([(track_id, scene, cluster, features)])
+
+    def add_many(self, rows):
+        """
+        Adds or updates tracks in one transaction.
+
+        Parameters:
+        rows (iterable): (track_id, scene, cluster, features) tuples, see add.
+        """
+        with self._lock:
+            records = []
+            for track_id, scene, cluster, features in rows:
+                entry = dict(self.tracks.get(track_id) or {'scene': None, 'cluster': None, 'features': {}})
+                if scene is not None:
+                    entry['scene'] = scene
+                if cluster is not None:
+                    entry['cluster'] = int(cluster)
+                if features is not None:
+                    entry['features'] = dict(features)
+                self.tracks[track_id] = entry
+                records.append((track_id, entry['scene'], entry['cluster'], json.dumps(entry['features'])))
+            with self.connection:
+                self.connection.executemany('INSERT OR REPLACE INTO tracks (id, scene, cluster, features) '
+                                            'VALUES (?, ?, ?, ?)', records)
+
+    def import_csv(self, path, id_column='id', scene_column='scene', cluster_column='cluster'):
+        """
+        Adds every track of a playlist CSV with an id column and, where present, scene, cluster and the
+        FEATURE_COLUMNS.
+
+        Returns:
+        int: The number of tracks imported.
+        """
+        rows = []
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                features = {column: float(row[column]) for column in FEATURE_COLUMNS if _optional(row.get(column))}
+                rows.append((row[id_column], _optional(row.get(scene_column)),
+                             _optional(row.get(cluster_column), lambda value: int(float(value))), features))
+        self.add_many(rows)
+        return len(rows)
+
+    def close(self):
+        self.connection.close()
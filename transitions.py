@@ -0,0 +1,76 @@
+"""
+Provides the Transition class, which blends the outgoing and incoming scenes frame by frame after a scene change.
+
+While a transition runs, the outgoing scene's plan keeps rendering into its own universe buffer alongside the incoming
+one, and each frame sends a per-channel linear blend of the two, so a change costs one extra render and one blend per
+frame for its duration instead of a blackout. A change that interrupts a transition has no single outgoing scene, so
+it blends out of the last frame sent, held still. The modes are:
+
+    cut        switch at the next frame
+    crossfade  blend from the old scene to the new one over the duration
+    black      fade the old scene out over the first half and the new one in over the second
+"""
+
+import numpy as np
+
+TRANSITIONS = ('cut', 'crossfade', 'black')
+DEFAULT_TRANSITION = 'crossfade'
+DEFAULT_TRANSITION_MS = 500
+
+def transition_weights(mode, progress):
+    """
+    Returns the (outgoing, incoming) weights at progress (0 to 1) through a transition.
+    """
+    if mode == 'crossfade':
+        return 1.0 - progress, progress
+    if mode == 'black':
+        return max(1.0 - 2.0 * progress, 0.0), max(2.0 * progress - 1.0, 0.0)
+    return 0.0, 1.0
+
+class Transition:
+    def __init__(self, plan, universes, mode=DEFAULT_TRANSITION, duration_ms=DEFAULT_TRANSITION_MS):
+        """
+        Parameters:
+        plan (ScenePlan): The outgoing scene's plan, or None to hold the outgoing frame still.
+        universes (np.array): The (universes, UNIVERSE_SIZE) frame the outgoing scene left, which its plan keeps
+            rendering into from here on.
+        mode (str): One of TRANSITIONS.
+        duration_ms (float): How long the transition takes.
+        """
+        if mode not in TRANSITIONS:
+            raise ValueError(f"Transition '{mode}' not found. Options are: {', '.join(TRANSITIONS)}")
+        self.plan = plan
+        self.mode = mode
+        self.duration = max(duration_ms, 0) / 1000.0
+        self.start = None  # the time of the first frame, set by blend
+        self.universes = universes.copy()
+        self.universe = self.universes.reshape(-1)
+        self.out = np.zeros_like(self.universes)
+        # 8.8 fixed point, so the blend stays in integer arrays
+        self._outgoing = np.zeros(self.universes.shape, dtype=np.uint16)
+        self._incoming = np.zeros(self.universes.shape, dtype=np.uint16)
+
+    def progress(self, now):
+        if self.mode == 'cut' or self.duration == 0:
+            return 1.0
+        if self.start is None:
+            return 0.0
+        return min((now - self.start) / self.duration, 1.0)
+
+    def done(self, now):
+        return self.start is not None and self.progress(now) >= 1.0
+
+    def blend(self, universes, now):
+        """
+        Returns the frame to send at time now: the outgoing scene's frame blended with the incoming scene's. The array
+        is reused by the next call.
+        """
+        if self.start is None:
+            self.start = now
+        outgoing, incoming = transition_weights(self.mode, self.progress(now))
+        np.multiply(self.universes, np.uint16(round(outgoing * 256)), out=self._outgoing)
+        np.multiply(universes, np.uint16(round(incoming * 256)), out=self._incoming)
+        self._outgoing += self._incoming
+        np.right_shift(self._outgoing, 8, out=self._outgoing)
+        np.copyto(self.out, self._outgoing, casting='unsafe')
+        return self.out
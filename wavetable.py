@@ -0,0 +1,111 @@
+"""
+Provides the wavetables and the Oscillators class that drive time-modulated lights.
+
+Each wave is one cycle of levels between 0 and 1, precomputed into a TABLE_SIZE table, and each light is a phase
+accumulator (in cycles) in an array. Every frame the accumulators advance by frequency * elapsed time (or are set
+from the beat position for beat-synced lights) and all levels are looked up with one gather, so the cost of a frame
+doesn't grow with the number of branches or wave shapes in the scene.
+
+Frequencies are in cycles per second, or cycles per beat for beat-synced lights. Every built-in wave starts its
+cycle at its peak (sawtooth_forward ends it there), so beat-synced waves hit on the beat.
+"""
+
+import numpy as np
+
+TABLE_SIZE = 1024
+
+def _phase():
+    return np.arange(TABLE_SIZE) / TABLE_SIZE
+
+WAVETABLES = {
+    'sine': (0.5 + 0.5 * np.cos(2 * np.pi * _phase())).astype(np.float32),
+    'square': (_phase() < 0.5).astype(np.float32),
+    'triangle': np.abs(1 - 2 * _phase()).astype(np.float32),
+    'sawtooth_forward': _phase().astype(np.float32),
+    'sawtooth_backward': (1 - _phase()).astype(np.float32),
+}
+
+def make_wavetable(values):
+    """
+    Resamples one cycle of levels (any length, values between 0 and 1) onto a TABLE_SIZE table, interpolating
+    linearly and wrapping around at the end of the cycle.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim != 1 or len(values) < 2:
+        raise ValueError("A wavetable needs at least two values")
+    if values.min() < 0 or values.max() > 1:
+        raise ValueError("Wavetable values have to be between 0 and 1")
+    source = np.arange(len(values) + 1) / len(values)
+    return np.interp(_phase(), source, np.append(values, values[0])).astype(np.float32)
+
+def register_wavetable(name, values):
+    """
+    Adds a custom wave that lights can then use by name in their function field.
+    """
+    WAVETABLES[name] = make_wavetable(values)
+
+def get_wavetable(function):
+    if function not in WAVETABLES:
+        raise ValueError(f"Function '{function}' not found. Options are: {', '.join(WAVETABLES)}")
+    return WAVETABLES[function]
+
+def wave_level(function, position):
+    """
+    Returns the level of a wave at a position in cycles. Works element-wise on arrays.
+    """
+    table = get_wavetable(function)
+    if np.isscalar(position):
+        return float(table[int(position % 1.0 * TABLE_SIZE) % TABLE_SIZE])
+    index = (np.mod(position, 1.0) * TABLE_SIZE).astype(np.intp) % TABLE_SIZE
+    return table[index]
+
+class Oscillators:
+    def __init__(self, functions, frequencies, synced=None):
+        """
+        Parameters:
+        functions (list): For each oscillator, the name of a wavetable or a list of levels for a custom one-off wave.
+        frequencies (list): For each oscillator, cycles per second, or cycles per beat if it is synced.
+        synced (list): For each oscillator, whether it follows the beat position instead of the clock.
+        """
+        tables, table_index = [], []
+        names = {}
+        for function in functions:
+            if isinstance(function, str):
+                if function not in names:
+                    names[function] = len(tables)
+                    tables.append(get_wavetable(function))
+                table_index.append(names[function])
+            else:
+                table_index.append(len(tables))
+                tables.append(make_wavetable(function))
+        n = len(functions)
+        # all tables end to end, so an oscillator's sample is table_start + index into one flat array
+        self.tables = np.concatenate(tables) if tables else np.zeros(0, dtype=np.float32)
+        self.table_start = np.array(table_index, dtype=np.intp) * TABLE_SIZE
+        self.frequency = np.array(frequencies, dtype=np.float64)
+        self.synced = np.zeros(n, dtype=bool) if synced is None else np.array(synced, dtype=bool)
+        self.phase = np.zeros(n, dtype=np.float64)
+        self.level = np.zeros(n, dtype=np.float32)
+        self.last_time = None
+        self._index = np.zeros(n, dtype=np.intp)
+
+    def __len__(self):
+        return len(self.phase)
+
+    def advance(self, now, beats=0.0):
+        """
+        Moves every oscillator to time now (seconds) and beat position beats.
+
+        Returns:
+        np.array: The level of every oscillator. The array is reused by the next call.
+        """
+        elapsed = 0.0 if self.last_time is None else max(now - self.last_time, 0.0)
+        self.last_time = now
+        self.phase += self.frequency * elapsed
+        np.copyto(self.phase, self.frequency * beats, where=self.synced)
+        np.mod(self.phase, 1.0, out=self.phase)
+        np.multiply(self.phase, TABLE_SIZE, out=self._index, casting='unsafe')
+        np.minimum(self._index, TABLE_SIZE - 1, out=self._index)
+        self._index += self.table_start
+        np.take(self.tables, self._index, out=self.level)
+        return self.level